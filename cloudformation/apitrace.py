@@ -0,0 +1,118 @@
+'''
+Record every AWS API call made through a boto3 session.
+
+Handlers on the botocore event system note the service, operation, region, latency,
+number of attempts and throttled attempts of each call. The handlers are registered on
+the session and copied to each client when it's made, so 'ApiTrace.install' must be
+called before any client is created, see 'aws.get_client'.
+
+To use:
+
+trace = ApiTrace()
+trace.install(aws.get_session())
+...
+print('\\n'.join(trace.format_summary()))
+trace.write('trace.json')
+'''
+import json
+import threading
+import time
+
+from poll import THROTTLING_ERROR_CODES
+
+
+class ApiTrace(object):
+    """Collects one record per API call. Thread safe."""
+    def __init__(self):
+        self.started = time.time()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def install(self, session):
+        """Register the trace handlers on boto3 'session'."""
+        events = session.events
+        events.register('before-call', self._before_call)
+        events.register('needs-retry', self._needs_retry)
+        events.register('after-call', self._after_call)
+        events.register('after-call-error', self._after_call_error)
+
+    def _before_call(self, model, context, **kwargs):
+        context['apitrace'] = {
+            'service': model.service_model.service_name,
+            'operation': model.name,
+            'region': context.get('client_region'),
+            'start': time.time(),
+            'attempts': 1,
+            'throttles': 0,
+        }
+
+    def _needs_retry(self, attempts, request_dict, response=None, **kwargs):
+        call = request_dict.get('context', {}).get('apitrace')
+        if call is None:
+            return
+        call['attempts'] = attempts
+        if response is not None and response[1].get('Error', {}).get('Code') in THROTTLING_ERROR_CODES:
+            call['throttles'] += 1
+
+    def _finish(self, context, error):
+        call = context.pop('apitrace', None)
+        if call is None:
+            return
+        call['latency'] = time.time() - call['start']
+        call['start'] -= self.started
+        call['error'] = error
+        with self.lock:
+            self.calls.append(call)
+
+    def _after_call(self, http_response, parsed, context, **kwargs):
+        error = None
+        if http_response.status_code >= 300:
+            error = parsed.get('Error', {}).get('Code') or str(http_response.status_code)
+        self._finish(context, error)
+
+    def _after_call_error(self, exception, context, **kwargs):
+        self._finish(context, type(exception).__name__)
+
+    def get_summary(self):
+        """
+        Returns a list of dicts, one for each service, operation and region, with the
+        number of calls, errors, retries and throttles and the total and max latency.
+        Sorted by total latency, the most expensive first.
+        """
+        rows = {}
+        with self.lock:
+            calls = list(self.calls)
+        for call in calls:
+            key = (call['service'], call['operation'], call['region'])
+            row = rows.setdefault(key, {
+                'service': call['service'], 'operation': call['operation'], 'region': call['region'],
+                'calls': 0, 'errors': 0, 'retries': 0, 'throttles': 0, 'total': 0.0, 'max': 0.0,
+            })
+            row['calls'] += 1
+            row['errors'] += 1 if call['error'] else 0
+            row['retries'] += call['attempts'] - 1
+            row['throttles'] += call['throttles']
+            row['total'] += call['latency']
+            row['max'] = max(row['max'], call['latency'])
+        return sorted(rows.values(), key=lambda row: row['total'], reverse=True)
+
+    def format_summary(self):
+        """Returns the summary as a list of lines of a text table."""
+        summary = self.get_summary()
+        lines = ["{:<40} {:<14} {:>6} {:>6} {:>7} {:>9} {:>9} {:>9} {:>9}".format(
+            "Operation", "Region", "Calls", "Errors", "Retries", "Throttles", "Total ms", "Avg ms", "Max ms")]
+        for row in summary:
+            lines.append("{:<40} {:<14} {:>6} {:>6} {:>7} {:>9} {:>9.0f} {:>9.0f} {:>9.0f}".format(
+                "{}.{}".format(row['service'], row['operation']), row['region'] or '-',
+                row['calls'], row['errors'], row['retries'], row['throttles'],
+                row['total'] * 1000.0, row['total'] * 1000.0 / row['calls'], row['max'] * 1000.0))
+        lines.append("{} calls in {:.1f} s.".format(
+            sum(row['calls'] for row in summary), time.time() - self.started))
+        return lines
+
+    def write(self, filename):
+        """Write all the call records and the summary to 'filename' as json."""
+        with self.lock:
+            calls = sorted(self.calls, key=lambda call: call['start'])
+        with open(filename, 'w') as f:
+            json.dump({'calls': calls, 'summary': self.get_summary()}, f, indent=4)
@@ -56,8 +56,8 @@ class DriftTemplate(object):
         """
         self.template_name = template_name
         self.t = Template()
-        t.add_version("2010-09-09")
-        t.add_description(description)
+        self.t.add_version("2010-09-09")
+        self.t.add_description(description)
 
         # Parameters required for all Drift templates
         self.stack_group = self.t.add_parameter(Parameter(
@@ -100,7 +100,7 @@ class DriftTemplate(object):
         if index is None:
             value = ImportValue(export_name)
         else:
-            value = Select(str(index), Split(',', ImportValue(export_name))),
+            value = Select(str(index), Split(',', ImportValue(export_name)))
 
         return value
 
@@ -114,10 +114,9 @@ class DriftTemplate(object):
         Name=<TIERNAME>-<resource_name>
         tier=<TIERNAME>
         """
-        def __init__(self, resource_name, **kwargs):
-            kwargs["Name"] = _(self.get_tier_name(), "-{}".format(resource_name))
-            kwargs["tier"] = self.get_tier_name()
-            return TierTags(**kwargs)
+        kwargs["Name"] = _(self.get_tier_name(), "-{}".format(resource_name))
+        kwargs["tier"] = self.get_tier_name()
+        return Tags(**kwargs)
 
 
 t = Template()
@@ -239,5 +238,12 @@ class AsgTest(DriftTemplate):
 
         self.export_value('rootcert', "Certificate for root domain.", Ref('mycert'))
 
-print AsgTest().t.to_json()
-#print t.to_json()
+
+def get_template():
+    """Returns the template, used by generate.py."""
+    return AsgTest().t
+
+
+if __name__ == '__main__':
+    print(get_template().to_json())
+    #print(t.to_json())
@@ -0,0 +1,57 @@
+'''
+Shared boto3 session and clients.
+
+All AWS calls go through clients made here so credentials are resolved once and every
+client has the same connection pool and retry settings. Clients are cached and thread
+safe, so concurrent calls reuse the keep-alive connections of one pool instead of
+opening new ones. boto3 sessions are not thread safe, so creating clients is
+serialized with a lock.
+'''
+import threading
+
+
+# Maximum number of pooled connections per client. It should be at least the number of
+# threads sharing a client or calls end up waiting for a connection.
+DEFAULT_POOL_SIZE = 16
+
+# Retry settings for all clients. The adaptive mode adds client side rate limiting on
+# top of the exponential backoff of the standard mode when throttled.
+RETRIES = {'mode': 'adaptive', 'max_attempts': 10}
+
+_session = None
+_clients = {}
+_account_id = None
+_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the shared boto3 session."""
+    global _session
+    import boto3
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_client(service_name, region_name=None, max_pool_connections=DEFAULT_POOL_SIZE):
+    """
+    Returns a boto3 client for 'service_name' in 'region_name'. Clients are cached by
+    service, region and pool size.
+    """
+    from botocore.config import Config
+    session = get_session()
+    key = (service_name, region_name, max_pool_connections)
+    with _lock:
+        if key not in _clients:
+            config = Config(max_pool_connections=max_pool_connections, retries=RETRIES)
+            _clients[key] = session.client(service_name, region_name=region_name, config=config)
+        return _clients[key]
+
+
+def get_account_id(region_name=None):
+    """Returns the id of the AWS account the shared session's credentials belong to."""
+    global _account_id
+    if _account_id is None:
+        _account_id = get_client('sts', region_name).get_caller_identity()['Account']
+    return _account_id
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+'''
+AWS code path benchmark against a local stand-in for CloudFormation.
+
+Runs the stack listing, event polling, resource listing, stack watching and stack
+creation code of cli.py, cfn.py, stacks.py and watch.py against a synthetic account,
+see fakeaws.py, and reports the number of API calls and wall clock time of each. No
+request leaves the process and no credentials are needed. The API call counts are
+checked as well, i.e. that all pages were read, that an incremental event poll only
+reads what is new and that drift stacks are listed without describing each of them,
+and the benchmark exits with an error if any check fails:
+
+python benchmarks/bench_aws.py
+python benchmarks/bench_aws.py --stacks 5000 --events 20 --latency 0.05
+
+Each API call sleeps for --latency seconds to stand in for the network round trip, so
+the timings show how well calls are spread over threads and connections.
+'''
+import argparse
+import contextlib
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+import aws  # noqa: E402
+import cfn  # noqa: E402
+import cli  # noqa: E402
+from fakeaws import FakeAWS, PAGE_SIZE  # noqa: E402
+from poll import PollScheduler, SeenEvents  # noqa: E402
+import stacks  # noqa: E402
+import watch  # noqa: E402
+
+
+TIER_NAMES = ('DEVNORTH', 'LIVENORTH')
+
+# A stack with a long event history
+OLD_STACK_EVENTS = 5000
+
+
+def pages(count):
+    return max(1, (count + PAGE_SIZE - 1) // PAGE_SIZE)
+
+
+class Scenario(object):
+    """Counts the API calls made and the time spent within a 'with' block."""
+    def __init__(self, fake, name):
+        self.fake = fake
+        self.name = name
+        self.problems = []
+
+    def __enter__(self):
+        self.before = self.fake.calls.copy()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.time() - self.start
+        self.calls = self.fake.calls - self.before
+
+    def check(self, ok, message):
+        if not ok:
+            self.problems.append("{}: {}".format(self.name, message))
+
+
+@contextlib.contextmanager
+def quiet():
+    """Send stdout to devnull, for code that prints its results."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def bench_list_stacks(fake, regions, stack_count):
+    with Scenario(fake, "list all stacks") as s:
+        summaries = list(cli._iter_stack_summaries(regions))
+    s.check(len(summaries) == stack_count, "got {} stacks, not {}".format(len(summaries), stack_count))
+    expected = sum(pages(len(fake.stacks[region])) for region in regions)
+    s.check(s.calls['DescribeStacks'] == expected,
+            "{} DescribeStacks calls, not {}".format(s.calls['DescribeStacks'], expected))
+    yield s
+
+    drift_stacks = [stack for region in regions for stack in fake.stacks[region].values()
+                    if stack.tags.get('drift:tier') == TIER_NAMES[0]]
+    with Scenario(fake, "list tagged stacks") as s:
+        summaries = list(cli._iter_stack_summaries(regions, {TIER_NAMES[0]}))
+    s.check(len(summaries) == len(drift_stacks), "got {} stacks, not {}".format(len(summaries), len(drift_stacks)))
+    s.check(not s.calls['DescribeStacks'], "{} DescribeStacks calls".format(s.calls['DescribeStacks']))
+    # Regions without drift stacks stop after the tagging API
+    expected = sum(pages(len(fake.stacks[region])) for region in set(stack.region for stack in drift_stacks))
+    s.check(s.calls['ListStacks'] == expected,
+            "{} ListStacks calls, not {}".format(s.calls['ListStacks'], expected))
+    yield s
+
+
+def bench_events(fake, cfn_client, stack_name, event_count):
+    with Scenario(fake, "read all events") as s:
+        events = list(cfn.get_events(cfn_client, stack_name))
+    s.check(len(events) == event_count, "got {} events, not {}".format(len(events), event_count))
+    s.check(s.calls['DescribeStackEvents'] == pages(event_count),
+            "{} pages read, not {}".format(s.calls['DescribeStackEvents'], pages(event_count)))
+    yield s
+
+    seen = SeenEvents()
+    seen.add(events[-1]['EventId'])
+    with Scenario(fake, "poll new events") as s:
+        new_events = stacks.get_new_events(cfn_client, stack_name, seen)
+    s.check(not new_events, "{} events are not new".format(len(new_events)))
+    s.check(s.calls['DescribeStackEvents'] == 1,
+            "{} pages read, not 1".format(s.calls['DescribeStackEvents']))
+    yield s
+
+
+def bench_tail(fake, cfn_client, region, stack_name, duration):
+    history = len(fake.stacks[region][stack_name].visible_events(time.time()))
+    fake.start_operation(region, stack_name, duration=duration)
+    scheduler = PollScheduler(min_delay=0.5, max_delay=2.0)
+    with Scenario(fake, "tail stack") as s:
+        with quiet():
+            cfn.tail(cfn_client, stack_name, scheduler)
+    # The history is read once up front, then it's one call per poll
+    max_polls = pages(history) + 2 + int(duration / scheduler.min_delay)
+    s.check(s.calls['DescribeStackEvents'] <= max_polls,
+            "{} DescribeStackEvents calls, expected at most {}".format(s.calls['DescribeStackEvents'], max_polls))
+    yield s
+
+
+def bench_describe_resources(fake, cfn_client, region, max_workers):
+    stack_count = len(fake.stacks[region])
+    for workers in sorted(set([1, max_workers])):
+        with Scenario(fake, "describe resources, {} workers".format(workers)) as s:
+            with quiet():
+                cfn.describe_resources(cfn_client, None, max_workers=workers)
+        s.check(s.calls['ListStackResources'] == stack_count,
+                "{} ListStackResources calls for {} stacks".format(s.calls['ListStackResources'], stack_count))
+        yield s
+
+
+def bench_watch(fake, cfn_client, region, count, duration, max_workers):
+    stack_names = list(fake.stacks[region])[:count]
+    for stack_name in stack_names:
+        fake.start_operation(region, stack_name, duration=duration)
+    with Scenario(fake, "watch {} stacks".format(count)) as s:
+        watches = watch.watch_stacks(cfn_client, stack_names, lambda stack_name, e: None, max_workers)
+    failed = [w.stack_name for w in watches if w.status != 'UPDATE_COMPLETE']
+    s.check(not failed, "{} stacks did not finish".format(len(failed)))
+    yield s
+
+
+def bench_create_stack(fake, cfn_client, region):
+    stack_name = 'DEVNORTH-bench-{}'.format(int(time.time()))
+    with Scenario(fake, "create stack") as s:
+        with quiet():
+            created = cfn.create_stack(cfn_client, stack_name, template='{"Resources": {}}')
+    s.check(created, "the stack was not created")
+    s.check(s.calls['CreateStack'] == 1, "{} CreateStack calls".format(s.calls['CreateStack']))
+    yield s
+
+    with Scenario(fake, "wait for stack") as s:
+        status = stacks.wait_for_stack(cfn_client, stack_name, seen=SeenEvents(),
+                                       scheduler=PollScheduler(min_delay=0.5, max_delay=2.0))
+    s.check(status == 'CREATE_COMPLETE', "the stack is {}".format(status))
+    yield s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stacks", type=int, default=1000,
+                        help="number of stacks in the account (default %(default)s)")
+    parser.add_argument("--events", type=int, default=10,
+                        help="number of events per stack (default %(default)s)")
+    parser.add_argument("--regions", type=int, default=2,
+                        help="number of regions the stacks are spread over (default %(default)s)")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="seconds per API call (default %(default)s)")
+    parser.add_argument("-w", "--max-workers", type=int, default=aws.DEFAULT_POOL_SIZE,
+                        help="threads for concurrent calls (default %(default)s)")
+    parser.add_argument("--watch", type=int, default=20,
+                        help="number of stacks to watch (default %(default)s)")
+    parser.add_argument("--duration", type=float, default=5.0,
+                        help="seconds a watched stack operation takes (default %(default)s)")
+    values = parser.parse_args()
+
+    regions = ['eu-west-1', 'us-east-1', 'ap-southeast-1', 'us-west-2'][:values.regions]
+    start = time.time()
+    fake = FakeAWS(stack_count=values.stacks, events_per_stack=values.events, regions=regions,
+                   tier_names=TIER_NAMES, latency=values.latency)
+    region = regions[0]
+    old_stack = list(fake.stacks[region].values())[0]
+    fake._add_history(old_stack, old_stack.created - OLD_STACK_EVENTS, OLD_STACK_EVENTS)
+    old_stack.events.sort(key=lambda e: e[0], reverse=True)
+    event_count = sum(len(stack.events) for r in regions for stack in fake.stacks[r].values())
+    print("{} stacks and {} events in {} regions, made in {:.1f} s.".format(
+        values.stacks, event_count, len(regions), time.time() - start))
+
+    # The fake must be installed before any client is made
+    fake.install(aws.get_session())
+    cfn_client = aws.get_client('cloudformation', region)
+
+    scenarios = [
+        bench_list_stacks(fake, regions, values.stacks),
+        bench_events(fake, cfn_client, old_stack.name, len(old_stack.events)),
+        bench_tail(fake, cfn_client, region, old_stack.name, values.duration),
+        bench_describe_resources(fake, cfn_client, region, values.max_workers),
+        bench_watch(fake, cfn_client, region, values.watch, values.duration, values.max_workers),
+        bench_create_stack(fake, cfn_client, region),
+    ]
+
+    print("{:<32} {:>8} {:>10} {:>10}".format("Scenario", "Calls", "Seconds", "Calls/s"))
+    problems = []
+    for scenario in scenarios:
+        for s in scenario:
+            calls = sum(s.calls.values())
+            print("{:<32} {:>8} {:>10.2f} {:>10.0f}".format(s.name, calls, s.seconds, calls / max(s.seconds, 1e-6)))
+            problems.extend(s.problems)
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
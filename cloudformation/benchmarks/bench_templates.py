@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+'''
+Template rendering benchmark.
+
+Renders each registered generator (see generate.py) a number of times and reports the
+median construction and minified json rendering time, the peak memory of a single
+render and the size of the output, minified and indented. Results are compared with
+a stored baseline and the benchmark exits with an error if a template got much slower
+or bigger, or if it's getting close to the CloudFormation limit for template bodies
+passed inline, i.e.:
+
+python benchmarks/bench_templates.py                   # Compare with the baseline
+python benchmarks/bench_templates.py --save-baseline   # Store a new baseline
+
+The stand-alone scripts (vpc.py, iam.py, asgtest.py) build their template when they
+are imported, which is left out of the measurements. Their construct time only covers
+'get_template()'.
+Timings depend on the machine so store a baseline before comparing on a new one.
+'''
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+
+import generate  # noqa: E402
+from templatestore import MAX_TEMPLATE_BODY_SIZE  # noqa: E402
+
+
+BASELINE_FILE = os.path.join(HERE, 'templates-baseline.json')
+
+# Warn when a template gets over this fraction of MAX_TEMPLATE_BODY_SIZE
+SIZE_WARNING = 0.8
+
+# Timings that went up by less than this many ms are noise, not a regression
+MIN_TIME_INCREASE = 1.0
+
+
+def render(name, module_name):
+    """Returns (body, pretty body, construct time, render time) for generator 'name'."""
+    _, body, pretty_body, construct_time, render_time, _, problems = generate.render(name, module_name)
+    if problems:
+        raise RuntimeError('\n'.join(problems))
+    return body, pretty_body, construct_time, render_time
+
+
+def bench(name, module_name, repeat):
+    """Returns the benchmark results for generator 'name' as a dict."""
+    render(name, module_name)  # Warm up, imports the module
+
+    construct_times, render_times = [], []
+    for i in range(repeat):
+        body, pretty_body, construct_time, render_time = render(name, module_name)
+        construct_times.append(construct_time * 1000.0)
+        render_times.append(render_time * 1000.0)
+
+    tracemalloc.start()
+    render(name, module_name)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'construct_ms': sorted(construct_times)[len(construct_times) // 2],
+        'render_ms': sorted(render_times)[len(render_times) // 2],
+        'peak_kb': peak / 1024.0,
+        'bytes': len(pretty_body.encode('utf-8')),
+        'minified_bytes': len(body.encode('utf-8')),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Returns a list of problems with 'result' compared to 'baseline'."""
+    problems = []
+    for key in ['construct_ms', 'render_ms', 'peak_kb', 'bytes']:
+        if key not in baseline or result[key] <= baseline[key] * (1.0 + tolerance):
+            continue
+        if key.endswith('_ms') and result[key] - baseline[key] < MIN_TIME_INCREASE:
+            continue
+        problems.append("{} went from {:.1f} to {:.1f}".format(key, baseline[key], result[key]))
+    return problems
+
+
+def format_change(value, base):
+    if not base:
+        return ''
+    return "{:+.0f}%".format((value - base) * 100.0 / base)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs='*',
+                        help="generators to benchmark, all of them if omitted")
+    parser.add_argument("-n", "--repeat", type=int, default=20,
+                        help="number of renders per template (default %(default)s)")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.5,
+                        help="allowed increase over the baseline, 0.5 is 50%% (default %(default)s)")
+    parser.add_argument("--save-baseline", action='store_true',
+                        help="store the results as the new baseline")
+    values = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baseline = json.load(f)
+
+    generators = [(name, module_name) for name, module_name, filename in generate.get_generators()
+                  if not values.names or name in values.names]
+
+    print("{:<16} {:>12} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+        "Template", "Construct ms", "Render ms", "Peak KB", "Bytes", "Minified", "Change"))
+    results = {}
+    problems = []
+    for name, module_name in generators:
+        result = results[name] = bench(name, module_name, values.repeat)
+        base = baseline.get(name, {})
+        total = result['construct_ms'] + result['render_ms']
+        base_total = base.get('construct_ms', 0) + base.get('render_ms', 0)
+        print("{:<16} {:>12.2f} {:>10.2f} {:>10.0f} {:>10} {:>10} {:>8}".format(
+            name, result['construct_ms'], result['render_ms'], result['peak_kb'],
+            result['bytes'], result['minified_bytes'], format_change(total, base_total)))
+
+        problems.extend("{}: {}".format(name, problem) for problem in compare(result, base, values.tolerance))
+        if result['minified_bytes'] > MAX_TEMPLATE_BODY_SIZE * SIZE_WARNING:
+            problems.append("{}: {} bytes minified is over {:.0f}% of the {} byte limit for inline "
+                            "templates.".format(name, result['minified_bytes'], SIZE_WARNING * 100,
+                                                MAX_TEMPLATE_BODY_SIZE))
+
+    if values.save_baseline:
+        baseline.update(results)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print("Baseline saved to {}".format(BASELINE_FILE))
+        return
+
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,292 @@
+'''
+An in-process stand-in for CloudFormation and the Resource Groups Tagging API.
+
+The fake answers API calls from a 'before-call' handler on the shared boto3 session,
+see aws.py, so the real clients, paginators and response handling are used but no
+request leaves the process. Each call sleeps for a fixed 'latency' to stand in for the
+network round trip, which makes the effect of concurrency measurable. The account is
+synthetic and generated from a seed so runs are repeatable.
+
+Stack operations started with 'start_operation', or by CreateStack and UpdateStack, add
+their events over 'duration' seconds of wall clock time, so event polling can be
+exercised too.
+
+To use:
+
+fake = FakeAWS(stack_count=1000, events_per_stack=10)
+fake.install(aws.get_session())  # Before any client is made
+...
+print(fake.calls)
+'''
+import collections
+import datetime
+import random
+import threading
+import time
+import uuid
+
+from botocore.awsrequest import AWSResponse
+
+
+PAGE_SIZE = 100
+ACCOUNT_ID = '123456789012'
+RESOURCE_TYPES = [
+    'AWS::EC2::Subnet', 'AWS::EC2::RouteTable', 'AWS::EC2::SecurityGroup', 'AWS::EC2::NatGateway',
+    'AWS::EC2::VPCEndpoint', 'AWS::IAM::Role', 'AWS::Logs::LogGroup', 'AWS::SNS::Topic',
+]
+
+
+class FakeError(Exception):
+    def __init__(self, code, message, status=400):
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def _utc(seconds):
+    return datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc)
+
+
+class FakeStack(object):
+    """A stack with its events, newest first, and resources."""
+    def __init__(self, region, name, tags, created, status='CREATE_COMPLETE'):
+        self.region = region
+        self.name = name
+        self.stack_id = 'arn:aws:cloudformation:{}:{}:stack/{}/{}'.format(region, ACCOUNT_ID, name, uuid.uuid4())
+        self.tags = tags
+        self.created = created
+        self.status = status
+        self.events = []  # (timestamp, event, stack status after the event), newest first
+        self.resources = []
+        self.template_body = '{"Resources": {}}'
+
+    def add_event(self, timestamp, logical_id, resource_type, status):
+        event = {
+            'StackId': self.stack_id,
+            'EventId': str(uuid.uuid4()),
+            'StackName': self.name,
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': logical_id,
+            'ResourceType': resource_type,
+            'Timestamp': _utc(timestamp),
+            'ResourceStatus': status,
+        }
+        stack_status = status if logical_id == self.name else None
+        self.events.insert(0, (timestamp, event, stack_status))
+
+    def visible_events(self, now):
+        return [e for timestamp, e, stack_status in self.events if timestamp <= now]
+
+    def current_status(self, now):
+        for timestamp, e, stack_status in self.events:
+            if timestamp <= now and stack_status:
+                return stack_status
+        return self.status
+
+    def describe(self, now):
+        return {
+            'StackId': self.stack_id,
+            'StackName': self.name,
+            'Description': 'Synthetic stack.',
+            'CreationTime': _utc(self.created),
+            'StackStatus': self.current_status(now),
+            'Parameters': [],
+            'Tags': [{'Key': k, 'Value': v} for k, v in sorted(self.tags.items())],
+        }
+
+
+class FakeAWS(object):
+    """A synthetic account, see the module doc. Thread safe."""
+    def __init__(self, stack_count=1000, events_per_stack=10, resources_per_stack=5,
+                 regions=('eu-west-1',), tier_names=('DEVNORTH', 'LIVENORTH'), latency=0.02, seed=0):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.lock = threading.Lock()
+        self.stacks = {region: collections.OrderedDict() for region in regions}
+
+        rnd = random.Random(seed)
+        now = time.time()
+        for i in range(stack_count):
+            region = regions[i % len(regions)]
+            tier_name = tier_names[i % len(tier_names)]
+            name = '{}-stack{:05d}'.format(tier_name, i)
+            tags = {'drift:tier': tier_name, 'drift:template': 'stack{:05d}'.format(i)}
+            if i % 10 == 9:
+                tags = {}  # Not every stack in an account belongs to drift
+            created = now - 86400 - rnd.random() * 86400 * 30
+            stack = FakeStack(region, name, tags, created)
+            stack.resources = [
+                (rnd.choice(RESOURCE_TYPES), 'Resource{}'.format(j)) for j in range(resources_per_stack)
+            ]
+            self._add_history(stack, created, events_per_stack)
+            self.stacks[region][name] = stack
+
+    def _add_history(self, stack, start, count):
+        """Add 'count' events of a finished stack creation to 'stack'."""
+        stack.add_event(start, stack.name, 'AWS::CloudFormation::Stack', 'CREATE_IN_PROGRESS')
+        for j in range(max(count - 2, 0)):
+            resource_type, logical_id = stack.resources[j % len(stack.resources)] if stack.resources else (
+                'AWS::SNS::Topic', 'Resource0')
+            status = 'CREATE_IN_PROGRESS' if j % 2 == 0 else 'CREATE_COMPLETE'
+            stack.add_event(start + j + 1, logical_id, resource_type, status)
+        stack.add_event(start + count, stack.name, 'AWS::CloudFormation::Stack', 'CREATE_COMPLETE')
+
+    def start_operation(self, region, stack_name, duration=5.0, event_count=20, operation='UPDATE'):
+        """
+        Start an operation on 'stack_name' which adds 'event_count' events over the next
+        'duration' seconds and then ends with <operation>_COMPLETE.
+        """
+        stack = self.stacks[region][stack_name]
+        now = time.time()
+        with self.lock:
+            stack.add_event(now, stack.name, 'AWS::CloudFormation::Stack', operation + '_IN_PROGRESS')
+            for j in range(event_count):
+                resource_type, logical_id = stack.resources[j % len(stack.resources)]
+                status = operation + ('_IN_PROGRESS' if j % 2 == 0 else '_COMPLETE')
+                stack.add_event(now + duration * (j + 1) / (event_count + 1), logical_id, resource_type, status)
+            stack.add_event(now + duration, stack.name, 'AWS::CloudFormation::Stack', operation + '_COMPLETE')
+            stack.events.sort(key=lambda e: e[0], reverse=True)
+
+    def install(self, session):
+        """Answer all API calls made through clients of boto3 'session'."""
+        session.events.register('before-parameter-build', self._before_parameter_build)
+        session.events.register('before-call', self._before_call)
+
+    def _before_parameter_build(self, params, context, **kwargs):
+        # The serialized request is all 'before-call' gets, so keep the call arguments
+        context['fakeaws_params'] = dict(params)
+
+    def _before_call(self, model, params, context, **kwargs):
+        service = model.service_model.service_name
+        handler = getattr(self, '_{}_{}'.format(service.replace('-', '_'), model.name), None)
+        with self.lock:
+            self.calls[model.name] += 1
+        time.sleep(self.latency)
+        api_params = context.get('fakeaws_params', {})
+        region = context.get('client_region')
+        try:
+            if handler is None:
+                raise FakeError('InvalidAction', "{}.{} is not supported by the fake.".format(service, model.name))
+            with self.lock:
+                parsed = handler(region, api_params)
+            status = 200
+        except FakeError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+            status = e.status
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': status, 'RetryAttempts': 0})
+        return AWSResponse('https://fake/', status, {}, None), parsed
+
+    def _get_stack(self, region, name_or_id):
+        stacks = self.stacks[region]
+        if name_or_id in stacks:
+            return stacks[name_or_id]
+        for stack in stacks.values():
+            if stack.stack_id == name_or_id:
+                return stack
+        raise FakeError('ValidationError', "Stack with id {} does not exist".format(name_or_id))
+
+    def _page(self, items, token):
+        """Returns the page of 'items' at 'token' and the next token or None."""
+        start = int(token or 0)
+        end = start + PAGE_SIZE
+        return items[start:end], (str(end) if end < len(items) else None)
+
+    def _paged(self, key, items, token, token_key='NextToken'):
+        page, next_token = self._page(items, token)
+        response = {key: page}
+        if next_token:
+            response[token_key] = next_token
+        return response
+
+    def _cloudformation_DescribeStacks(self, region, params):
+        now = time.time()
+        if params.get('StackName'):
+            return {'Stacks': [self._get_stack(region, params['StackName']).describe(now)]}
+        stacks = [stack.describe(now) for stack in self.stacks[region].values()]
+        return self._paged('Stacks', stacks, params.get('NextToken'))
+
+    def _cloudformation_ListStacks(self, region, params):
+        now = time.time()
+        statuses = params.get('StackStatusFilter')
+        summaries = []
+        for stack in self.stacks[region].values():
+            status = stack.current_status(now)
+            if not statuses or status in statuses:
+                summaries.append({
+                    'StackId': stack.stack_id,
+                    'StackName': stack.name,
+                    'TemplateDescription': 'Synthetic stack.',
+                    'CreationTime': _utc(stack.created),
+                    'StackStatus': status,
+                })
+        return self._paged('StackSummaries', summaries, params.get('NextToken'))
+
+    def _cloudformation_DescribeStackEvents(self, region, params):
+        events = self._get_stack(region, params['StackName']).visible_events(time.time())
+        return self._paged('StackEvents', events, params.get('NextToken'))
+
+    def _cloudformation_ListStackResources(self, region, params):
+        stack = self._get_stack(region, params['StackName'])
+        summaries = [{
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': '{}-{}'.format(stack.name, logical_id),
+            'ResourceType': resource_type,
+            'ResourceStatus': 'CREATE_COMPLETE',
+            'LastUpdatedTimestamp': _utc(stack.created),
+        } for resource_type, logical_id in stack.resources]
+        return self._paged('StackResourceSummaries', summaries, params.get('NextToken'))
+
+    def _cloudformation_DescribeStackResources(self, region, params):
+        stack = self._get_stack(region, params['StackName'])
+        return {'StackResources': [{
+            'StackName': stack.name,
+            'StackId': stack.stack_id,
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': '{}-{}'.format(stack.name, logical_id),
+            'ResourceType': resource_type,
+            'ResourceStatus': 'CREATE_COMPLETE',
+            'Timestamp': _utc(stack.created),
+        } for resource_type, logical_id in stack.resources]}
+
+    def _cloudformation_GetTemplate(self, region, params):
+        return {'TemplateBody': self._get_stack(region, params['StackName']).template_body}
+
+    def _cloudformation_CreateStack(self, region, params):
+        name = params['StackName']
+        if name in self.stacks[region]:
+            raise FakeError('AlreadyExistsException', "Stack [{}] already exists".format(name))
+        stack = FakeStack(region, name, {t['Key']: t['Value'] for t in params.get('Tags', [])}, time.time(),
+                          status='CREATE_IN_PROGRESS')
+        stack.resources = [(RESOURCE_TYPES[j % len(RESOURCE_TYPES)], 'Resource{}'.format(j)) for j in range(5)]
+        stack.template_body = params.get('TemplateBody', stack.template_body)
+        self.stacks[region][name] = stack
+        self._start(stack, 'CREATE')
+        return {'StackId': stack.stack_id}
+
+    def _cloudformation_UpdateStack(self, region, params):
+        stack = self._get_stack(region, params['StackName'])
+        if stack.current_status(time.time()).endswith('_IN_PROGRESS'):
+            raise FakeError('ValidationError', "Stack {} is in an IN_PROGRESS state".format(stack.name))
+        stack.template_body = params.get('TemplateBody', stack.template_body)
+        self._start(stack, 'UPDATE')
+        return {'StackId': stack.stack_id}
+
+    def _start(self, stack, operation):
+        # Called with the lock held, see 'start_operation'
+        self.lock.release()
+        try:
+            self.start_operation(stack.region, stack.name, duration=2.0, event_count=10, operation=operation)
+        finally:
+            self.lock.acquire()
+
+    def _resourcegroupstaggingapi_GetResources(self, region, params):
+        filters = {f['Key']: f.get('Values') for f in params.get('TagFilters', [])}
+        mappings = []
+        for stack in self.stacks[region].values():
+            if all(key in stack.tags and (not values or stack.tags[key] in values)
+                   for key, values in filters.items()):
+                mappings.append({
+                    'ResourceARN': stack.stack_id,
+                    'Tags': [{'Key': k, 'Value': v} for k, v in sorted(stack.tags.items())],
+                })
+        return self._paged('ResourceTagMappingList', mappings, params.get('PaginationToken'), 'PaginationToken')
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+'''
+Start-up time benchmark for the cli.
+
+Runs a few cheap cli commands in a fresh interpreter and reports the wall clock time.
+Exits with an error if the median time of any command goes over the limit, so it
+can be used as a gate, i.e.:
+
+python benchmarks/startup.py --limit 100
+
+Use --importtime to see which modules a command spends its start-up time on.
+'''
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(HERE, '..', 'cli.py')
+
+COMMANDS = [
+    ['--help'],
+    ['--version'],
+    ['edit', 'tiers'],
+]
+
+
+def time_command(args, repeat):
+    """Returns a sorted list of wall clock times in ms for running the cli with 'args'."""
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, CLI] + args, stdout=devnull)
+            timings.append((time.time() - start) * 1000.0)
+    return sorted(timings)
+
+
+def show_importtime(args, top):
+    """Print the 'top' slowest modules imported when running the cli with 'args'."""
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', CLI] + args,
+            stdout=devnull, stderr=subprocess.PIPE, universal_newlines=True,
+        )
+        _, err = p.communicate()
+
+    # Lines look like: "import time:       123 |       4567 | module.name"
+    li = []
+    for line in err.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            li.append((int(parts[1]), parts[2].rstrip()))
+    li.sort(reverse=True)
+    for cumulative, name in li[:top]:
+        print("    {:8.1f} ms {}".format(cumulative / 1000.0, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--repeat", type=int, default=10,
+                        help="number of runs per command (default %(default)s)")
+    parser.add_argument("-l", "--limit", type=float, default=100.0,
+                        help="max median time in ms (default %(default)s)")
+    parser.add_argument("-i", "--importtime", action='store_true',
+                        help="show the slowest imports for each command")
+    values = parser.parse_args()
+
+    failed = False
+    for args in COMMANDS:
+        timings = time_command(args, values.repeat)
+        median = timings[len(timings) // 2]
+        over = median > values.limit
+        failed = failed or over
+        print("cli {:<15} min {:6.1f} ms  median {:6.1f} ms{}".format(
+            ' '.join(args), timings[0], median, "  OVER LIMIT" if over else ""))
+        if values.importtime:
+            show_importtime(args, 10)
+
+    if failed:
+        print("Start-up time is over the limit of {} ms.".format(values.limit))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+'''
+Content hash based build cache for rendered templates.
+
+A template is only re-rendered if the source of its generator, its parameters or the
+troposphere version changed, or if the rendered file itself was modified or removed.
+The cache manifest is kept next to the rendered files.
+'''
+import hashlib
+import importlib.util
+import json
+import os
+
+import troposphere
+
+
+MANIFEST_NAME = '.build-cache.json'
+
+
+def file_hash(filename):
+    """Returns the sha256 hex digest of the content of 'filename'."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def source_key(name, modules, params=None):
+    """
+    Returns a cache key for generator 'name' made from the source files of 'modules',
+    the generator 'params' and the troposphere version.
+    'modules' are module names or module objects. Named modules are not imported.
+    """
+    h = hashlib.sha256()
+    h.update(name.encode('utf-8'))
+    h.update(troposphere.__version__.encode('utf-8'))
+    h.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    for module in modules:
+        if hasattr(module, '__file__'):
+            filename = module.__file__
+        else:
+            filename = importlib.util.find_spec(module).origin
+        if filename.endswith('.pyc'):
+            filename = filename[:-1]
+        h.update(file_hash(filename).encode('utf-8'))
+    return h.hexdigest()
+
+
+class BuildCache(object):
+    """The build cache manifest for templates rendered into 'out_dir'."""
+    def __init__(self, out_dir):
+        self.filename = os.path.join(out_dir, MANIFEST_NAME)
+        try:
+            with open(self.filename) as f:
+                self.entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            self.entries = {}
+        self.dirty = False
+
+    def is_fresh(self, name, key, filename):
+        """Returns True if 'filename' was rendered by generator 'name' with 'key' and is untouched."""
+        entry = self.entries.get(name)
+        if not entry or entry['key'] != key or not os.path.exists(filename):
+            return False
+        return file_hash(filename) == entry['sha256']
+
+    def update(self, name, key, filename):
+        """Record that 'filename' was rendered by generator 'name' using 'key'."""
+        self.entries[name] = {
+            'key': key,
+            'filename': os.path.basename(filename),
+            'sha256': file_hash(filename),
+        }
+        self.dirty = True
+
+    def save(self):
+        """Write out the manifest if anything changed."""
+        if not self.dirty:
+            return
+        self.dirty = False
+        with open(self.filename, 'w') as f:
+            json.dump(self.entries, f, indent=4, sort_keys=True)
@@ -0,0 +1,77 @@
+'''
+A small on-disk cache for the cli.
+
+Values are stored as json files under the user's cache dir and expire after 'ttl'
+seconds. It's meant for things like stack summaries and tier records that change
+rarely but are expensive to look up.
+'''
+import json
+import os
+import re
+import tempfile
+import time
+
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'),
+    'drift-aws',
+)
+
+# Default time to live in seconds
+DEFAULT_TTL = 60
+
+
+class Cache(object):
+    """
+    Key/value cache where the key is made from one or more strings.
+    A 'ttl' of 0 disables the cache. If 'refresh' is set, cached values are ignored
+    but fresh values are still written out.
+    """
+    def __init__(self, ttl=DEFAULT_TTL, cache_dir=None, refresh=False):
+        self.ttl = ttl
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.refresh = refresh
+
+    def _name(self, key):
+        return '.'.join(re.sub(r'[^\w.-]', '_', str(part)) for part in key)
+
+    def _filename(self, key):
+        return os.path.join(self.cache_dir, self._name(key) + '.json')
+
+    def get(self, *key):
+        """Returns the value for 'key' or None if it's missing or expired."""
+        if not self.ttl or self.refresh:
+            return None
+        filename = self._filename(key)
+        try:
+            if time.time() - os.path.getmtime(filename) > self.ttl:
+                return None
+            with open(filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set(self, value, *key):
+        """Store 'value' under 'key'. The file is replaced atomically."""
+        if not self.ttl:
+            return
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f, default=str)
+        os.replace(tmp_name, self._filename(key))
+
+    def clear(self, *prefix):
+        """Remove all values whose key starts with 'prefix'."""
+        start = self._name(prefix) + '.'
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(start) and name.endswith('.json'):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
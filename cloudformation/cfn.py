@@ -1,118 +1,220 @@
 #!/usr/bin/env python
 
 import argparse
+import json
 import sys
-import time
-from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
 
 try:
-    import boto
-    import boto.cloudformation
+    from botocore.exceptions import ClientError
 except ImportError:
-    print("boto 2.8.0+ is required")
+    print("boto3 is required")
     sys.exit(1)
 
-def upload_template_to_s3(conn, region, bucket_name, key_name, template):
-    cloudformation_bucket = conn.lookup(bucket_name)
-    if not cloudformation_bucket:
-        cloudformation_bucket = conn.create_bucket(bucket_name, location=region)
-    key = cloudformation_bucket.new_key(key_name)
-    key.set_contents_from_string(template)
-    cfn_template_url = "https://s3.amazonaws.com/%s/%s" % (
-        bucket_name, key_name)
-    return cfn_template_url
+from apitrace import ApiTrace
+from aws import DEFAULT_POOL_SIZE, get_client, get_session
+from poll import PollScheduler, SeenEvents, call_polled, poll_once
+import stacks
+import templatediff
+import templatestore
+from validation import validate_template
 
+def upload_template_to_s3(s3_client, region, bucket_name, key_name, template):
+    """Upload 'template' unless it's already in the bucket and return its url."""
+    url, uploaded = templatestore.upload_template(s3_client, region, bucket_name, key_name, template)
+    if not uploaded:
+        print("Template '{}' is already in bucket '{}'.".format(key_name, bucket_name))
+    return url
+
+
+def get_deployed(cfn_client, stackname):
+    """
+    Returns the deployed template body, parameters dict and stack status of 'stackname',
+    or None if the stack doesn't exist.
+    """
+    deployed = stacks.get_deployed(cfn_client, stackname)
+    if deployed is None:
+        return None
+    body, params, tags, status = deployed
+    return body, params, status
+
+
+def create_stack(cfn_client, stackname, template=None, url=None, params=None, update=False, force=False):
+    """
+    Create or update 'stackname'. If 'template' is set, it's compared with the deployed
+    template and nothing is done if neither it nor 'params' changed, unless 'force'
+    is set. Returns False if the stack was left alone.
+    """
+    if template is not None and not force:
+        deployed = get_deployed(cfn_client, stackname)
+        if deployed is not None:
+            body, deployed_params, status = deployed
+            if status not in stacks.DEPLOYED_STATUSES:
+                print("Stack '{}' is {}.".format(stackname, status))
+            elif templatediff.is_unchanged(body, deployed_params, template, dict(params or [])):
+                print("Stack '{}' is up to date.".format(stackname))
+                return False
+            update = True
 
-def create_stack(conn, stackname, template=None, url=None, params=None, update=False):    
     if not update:
         print ("Creating stack '{}'".format(stackname))
-        apply_to_stack = conn.create_stack
+        apply_to_stack = cfn_client.create_stack
     else:
         print ("Updating stack '{}'".format(stackname))
-        apply_to_stack = conn.update_stack  
+        apply_to_stack = cfn_client.update_stack
 
-    try:        
-        if url:
-            stack_id = apply_to_stack(
-                stack_name=stackname, template_url=url, parameters=params)
-        else:
-            stack_id = apply_to_stack(
-                stack_name=stackname, template_body=template, parameters=params)
-    except boto.exception.BotoServerError as e:
-        body = literal_eval(e.body)
-        if not update and body['Error']['Code'] == "AlreadyExistsException":
+    kwargs = {'StackName': stackname, 'Parameters': stacks.to_parameters(dict(params or []))}
+    if url:
+        kwargs['TemplateURL'] = url
+    else:
+        kwargs['TemplateBody'] = template
+
+    try:
+        stack_id = apply_to_stack(**kwargs)['StackId']
+    except ClientError as e:
+        error = e.response['Error']
+        if not update and error['Code'] == "AlreadyExistsException":
             print("Stack '{}' already exists.".format(stackname))
-            return create_stack(conn, stackname, template, url, params, update=True)
+            return create_stack(cfn_client, stackname, template, url, params, update=True, force=True)
+        if update and any(r in error['Message'] for r in stacks.EMPTY_CHANGE_SET_REASONS):
+            print("Stack '{}' is up to date.".format(stackname))
+            return False
 
-        print ("Error: {} - {}".format(body['Error']['Code'], body['Error']['Message']))
+        print ("Error: {} - {}".format(error['Code'], error['Message']))
         print("Exiting...")
         sys.exit(1)
     print("Stack creation/update in progress:  %s - %s" % (stackname, stack_id))
+    return True
 
 
-def build_s3_name(stack_name):
-    timestamp = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-    name = stack_name
-    if stack_name.endswith('.json'):
-        name = stack_name[:-5]
-    return '%s-%s.json' % (name, timestamp)
+def build_s3_name(stack_name, template):
+    """Returns the S3 key for 'template', which only changes if the template does."""
+    return templatestore.get_template_key(stack_name, template)
 
 
-def describe_resources(conn, stackname):
+RESOURCE_COLUMNS = ['StackName', 'LogicalResourceId', 'ResourceType', 'ResourceStatus', 'PhysicalResourceId']
+
+
+def list_resources(cfn_client, stackname, resource_types=None):
+    """
+    Returns the resources of 'stackname', all pages of them, as a list of dicts with the
+    keys in RESOURCE_COLUMNS. If 'resource_types' is set, only resources of those types
+    are returned.
+    """
+    resources = []
+    pages = cfn_client.get_paginator('list_stack_resources').paginate(StackName=stackname)
+    for page in pages:
+        for r in page['StackResourceSummaries']:
+            if not resource_types or r['ResourceType'] in resource_types:
+                resource = {key: r.get(key, '') for key in RESOURCE_COLUMNS}
+                resource['StackName'] = stackname
+                resources.append(resource)
+    return resources
+
+
+def describe_resources(cfn_client, stackname, resource_types=None, output_format='table',
+                       max_workers=DEFAULT_POOL_SIZE):
+    """
+    Print out the resources of 'stackname', or of all stacks if it's None. The stacks
+    are listed concurrently on up to 'max_workers' threads, which should not exceed the
+    connection pool size of 'cfn_client'.
+    """
     if stackname is not None:
-        print(conn.describe_stack_resources(stackname))
+        stack_names = [stackname]
     else:
-        stacks = conn.describe_stacks()
-        for stack in stacks:
-            print("Resources for stack {0}:".format(stack.stack_name))
-            print(conn.describe_stack_resources(stack.stack_name))
+        stack_names = [
+            stack['StackName']
+            for page in cfn_client.get_paginator('describe_stacks').paginate()
+            for stack in page['Stacks']
+        ]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        resources = sum(executor.map(
+            lambda name: list_resources(cfn_client, name, resource_types), stack_names), [])
+
+    if output_format == 'json':
+        print(json.dumps(resources, indent=4))
+        return
+
+    widths = [max([len(column)] + [len(r[column]) for r in resources]) for column in RESOURCE_COLUMNS]
+    row_format = '  '.join('{:<%d}' % width for width in widths)
+    print(row_format.format(*RESOURCE_COLUMNS))
+    for r in resources:
+        print(row_format.format(*[r[column] for column in RESOURCE_COLUMNS]))
 
 
-def get_events(conn, stackname):
+def get_events(cfn_client, stackname, scheduler=None):
     """Get the events in batches and return in chronological order"""
-    next = None
+    kwargs = {'StackName': stackname}
     event_list = []
     while 1:
-        events = conn.describe_stack_events(stackname, next)
-        event_list.append(events)
-        if events.next_token is None:
+        response = call_polled(
+            cfn_client.describe_stack_events, scheduler=scheduler, **kwargs)
+        event_list.append(response['StackEvents'])
+        if not response.get('NextToken'):
             break
-        next = events.next_token
-        time.sleep(1)
+        kwargs['NextToken'] = response['NextToken']
     return reversed(sum(event_list, []))
 
 
-def tail(conn, stack_name):
-    """Show and then tail the event log"""
+def get_new_events(cfn_client, stackname, seen, scheduler=None):
+    """
+    Get the events not in 'seen' and return them in chronological order.
+    Pages are only read until an already seen event is found, so the cost of a poll
+    depends on the number of new events but not on the age of the stack.
+    Throttled calls are retried using the backoff state of 'scheduler'.
+    """
+    return stacks.get_new_events(cfn_client, stackname, seen, scheduler)
+
+
+def is_stack_finished(e):
+    """Returns True if 'e' is an event marking the end of a stack operation."""
+    is_stack_event = e['ResourceType'] == "AWS::CloudFormation::Stack"
+    creating_or_updating = e['ResourceStatus'] in [
+        "CREATE_IN_PROGRESS", "UPDATE_IN_PROGRESS"
+    ]
+    return is_stack_event and not creating_or_updating
+
+
+def tail(cfn_client, stack_name, scheduler=None):
+    """
+    Show and then tail the event log.
+    Polls quickly while events are coming in and backs off with jitter while
+    long running resources are being created.
+    """
     def tail_print(e):
-        print("%s %s %s" % (e.resource_status, e.resource_type, e.event_id))
+        print("%s %s %s" % (e['ResourceStatus'], e['ResourceType'], e['EventId']))
 
     # First dump the full list of events in chronological order and keep
     # track of the events we've seen already
-    seen = set()
-    initial_events = get_events(conn, stack_name)
+    scheduler = scheduler or PollScheduler()
+    seen = SeenEvents()
+    initial_events = get_new_events(cfn_client, stack_name, seen, scheduler)
     for e in initial_events:
         tail_print(e)
-        seen.add(e.event_id)
+        seen.add(e['EventId'])
+
+    # Nothing to follow if the last stack operation has already finished
+    if initial_events and is_stack_finished(initial_events[-1]):
+        return
 
     # Now keep looping through and dump the new events
     while 1:
-        events = get_events(conn, stack_name)
+        scheduler.sleep()
+        events = poll_once(get_new_events, cfn_client, stack_name, seen, scheduler)
+        if events is None:
+            continue
+        if events:
+            scheduler.activity()
+        else:
+            scheduler.idle()
         for e in events:
-            if e.event_id not in seen:
-                tail_print(e)
-            seen.add(e.event_id)
-
-            is_stack_event = e.resource_type == "AWS::CloudFormation::Stack"
-            creating_or_updating = e.resource_status in [
-                "CREATE_IN_PROGRESS", "UPDATE_IN_PROGRESS"
-            ]
+            tail_print(e)
+            seen.add(e['EventId'])
 
-            if is_stack_event and not creating_or_updating:
+            if is_stack_finished(e):
                 return
 
-        time.sleep(5)
-
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -120,7 +222,14 @@ if __name__ == "__main__":
     parser.add_argument("-b", "--bucket", dest="s3bucket",
                         help="Upload template to S3 bucket")
     parser.add_argument("-d", "--debug", action='store_true',
-                        help="Turn on boto debug logging")
+                        help="Turn on boto3 debug logging")
+    parser.add_argument("--trace-api", action='store_true',
+                        help="print a summary of all AWS API calls on exit")
+    parser.add_argument("--trace-file",
+                        help="write a json trace of all AWS API calls to this file on exit")
+    parser.add_argument("-f", "--force", action='store_true',
+                        help="update the stack even if the template and parameters "
+                             "are unchanged")
     parser.add_argument("-n", "--name", dest="s3name",
                         help="Template name in S3 bucket")
     parser.add_argument("-p", "--parameter", dest="params", action='append',
@@ -130,8 +239,24 @@ if __name__ == "__main__":
     parser.add_argument("-R", "--resources", action='store_true',
                         help="describe stack resources, list resources for "
                              "all stacks if no stack is specified")
+    parser.add_argument("--resource-type", dest="resource_types", action='append',
+                        help="only describe resources of this type, "
+                             "f.ex. AWS::EC2::NatGateway")
+    parser.add_argument("--format", dest="output_format", choices=['table', 'json'],
+                        default='table',
+                        help="output format of --resources (default %(default)s)")
+    parser.add_argument("-w", "--max-workers", type=int, default=DEFAULT_POOL_SIZE,
+                        help="number of stacks to describe concurrently "
+                             "(default %(default)s)")
     parser.add_argument("-t", "--tail", action='store_true',
                         help="tail event log")
+    parser.add_argument("--poll-min", type=float, default=2.0,
+                        help="shortest tail poll interval in seconds (default %(default)s)")
+    parser.add_argument("--poll-max", type=float, default=30.0,
+                        help="longest tail poll interval in seconds (default %(default)s)")
+    parser.add_argument("--prune", type=int, metavar="KEEP",
+                        help="delete all but the KEEP most recent versions of each "
+                             "template in the S3 bucket")
     parser.add_argument("stack", nargs='?')
     values = parser.parse_args()
 
@@ -144,29 +269,65 @@ if __name__ == "__main__":
         import logging
         logging.basicConfig(filename="boto.log", level=logging.DEBUG)
 
-    conn = boto.cloudformation.connect_to_region(values.region)
+    if values.trace_api or values.trace_file:
+        import atexit
+        trace = ApiTrace()
+        trace.install(get_session())
+
+        def report():
+            if values.trace_api:
+                print('\n'.join(trace.format_summary()))
+            if values.trace_file:
+                trace.write(values.trace_file)
+        atexit.register(report)
+
+    cfn_client = get_client('cloudformation', values.region,
+                            max_pool_connections=max(DEFAULT_POOL_SIZE, values.max_workers))
 
     if values.create:
         # Read in the template file
         template = open(values.create).read()
 
+        # Catch template mistakes before CloudFormation does. yaml is not checked.
+        ob = templatediff.load_template(template)
+        problems = validate_template(ob, dict(values.params)) if ob is not None else []
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+
+        # Templates too big to pass inline must go through S3
+        if not values.s3bucket and not templatestore.fits_inline(template):
+            values.s3bucket = templatestore.get_default_bucket(get_client('sts', values.region), values.region)
+            print("Template is over {} bytes, uploading it to bucket '{}'.".format(
+                templatestore.MAX_TEMPLATE_BODY_SIZE, values.s3bucket))
+
         # If needed, build an S3 name (key)
         if values.s3bucket and not values.s3name:
-            values.s3name = build_s3_name(values.create)
+            values.s3name = build_s3_name(values.create, template)
 
         if values.s3bucket:
             # Upload to S3 and create the stack
-            s3conn = boto.s3.connect_to_region(values.region)
+            s3_client = get_client('s3', values.region)
             url = upload_template_to_s3(
-                s3conn, values.region, values.s3bucket, values.s3name, template)
-            create_stack(conn, values.stack, None, url, values.params)
+                s3_client, values.region, values.s3bucket, values.s3name, template)
+            create_stack(cfn_client, values.stack, template, url, values.params, force=values.force)
         else:
             # Upload file as part of the stack creation
-            create_stack(conn, values.stack, template, None, values.params)
+            create_stack(cfn_client, values.stack, template, None, values.params, force=values.force)
+
+    if values.prune is not None:
+        if not values.s3bucket:
+            parser.error("--prune requires --bucket")
+        s3_client = get_client('s3', values.region)
+        for key in templatestore.prune_templates(s3_client, values.s3bucket, values.prune):
+            print("Deleted '{}'".format(key))
 
     if values.resources:
-        describe_resources(conn, values.stack)
+        describe_resources(cfn_client, values.stack, values.resource_types,
+                           values.output_format, values.max_workers)
 
     if values.tail:
-        tail(conn, values.stack)
+        scheduler = PollScheduler(min_delay=values.poll_min, max_delay=values.poll_max)
+        tail(cfn_client, values.stack, scheduler)
         print("Cloudformation execution finished.")
@@ -1,23 +1,14 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import queue
 import sys
 
-import boto3
 import click
-from tabulate import tabulate
 
-# pygments is optional for now
-try:
-    got_pygments = True
-    from pygments import highlight
-    from pygments.lexers import get_lexer_by_name
-    from pygments.formatters import get_formatter_by_name
-except ImportError:
-    got_pygments = False
-
-from driftconfig.util import get_default_drift_config
-
-import templater
+# NOTE: boto3, driftconfig, pygments and the template modules are imported where
+# they are used. They are slow to import and most commands only need a few of them.
+from cache import Cache, DEFAULT_TTL
 
 
 # Enable simple in-line color and styling of output
@@ -50,9 +41,17 @@ pass_globals = click.make_pass_decorator(Globals, ensure=True)
     help="Tier name.")
 @click.option('--verbose', '-v', is_flag=True,
     help='Enable verbose mode.')
+@click.option('--cache-ttl', envvar='DRIFT_AWS_CACHE_TTL', type=int, default=DEFAULT_TTL,
+    help="Seconds to cache stack and tier info. 0 disables the cache.")
+@click.option('--refresh', is_flag=True,
+    help="Ignore cached stack and tier info.")
+@click.option('--trace-api', is_flag=True,
+    help="Print a summary of all AWS API calls on exit.")
+@click.option('--trace-file', type=click.Path(dir_okay=False, writable=True),
+    help="Write a json trace of all AWS API calls to this file on exit.")
 @click.version_option('1.0')
 @pass_globals
-def cli(ctx, config_url, tier_name, verbose):
+def cli(ctx, config_url, tier_name, verbose, cache_ttl, refresh, trace_api, trace_file):
     """This command line tool helps you manage and maintain Drift
     Configuration databases.
     """
@@ -62,19 +61,55 @@ def cli(ctx, config_url, tier_name, verbose):
         os.environ['DRIFT_CONFIG_URL'] = config_url
     ctx.obj.tier_name = tier_name
     ctx.obj.verbose = verbose
+    ctx.obj.cache = Cache(ttl=cache_ttl, refresh=refresh)
+    if trace_api or trace_file:
+        _install_api_trace(trace_api, trace_file)
+
+
+def _install_api_trace(print_summary, filename):
+    """Trace all AWS API calls of this command and report on them when it exits."""
+    from apitrace import ApiTrace
+    from aws import get_session
+    trace = ApiTrace()
+    trace.install(get_session())
+
+    def report():
+        if print_summary:
+            click.secho('\n'.join(trace.format_summary()), err=True)
+        if filename:
+            trace.write(filename)
 
+    click.get_current_context().call_on_close(report)
 
-def _get_config_and_tier(tier_name=None):
-    """Returns 'ts' and 'tier' table if possible."""
+
+def _load_tiers(cache=None):
+    """Returns the domain name and all tier records, from 'cache' if possible."""
+    key = ('config', os.environ.get('DRIFT_CONFIG_URL') or 'default')
+    cached = cache.get(*key) if cache else None
+    if cached:
+        return cached['domain_name'], cached['tiers']
+
+    from driftconfig.util import get_default_drift_config
     ts = get_default_drift_config()
     domain_name = ts.get_table('domain')['domain_name']
     tiers = ts.get_table('tiers').find()
+    if cache:
+        cache.set({'domain_name': domain_name, 'tiers': tiers}, *key)
+    return domain_name, tiers
+
+
+def _get_tiers(tier_name=None, all_tiers=False, cache=None):
+    """Returns a list of 'tier' records, either one or all tiers in the config."""
+    domain_name, tiers = _load_tiers(cache)
     tier_name = tier_name or os.environ.get('DRIFT_TIER')
 
     if len(tiers) < 1:
         click.secho("No tier defined in config {}.".format(domain_name), fg='red', bold=True)
         sys.exit(1)
 
+    if all_tiers:
+        return tiers
+
     if len(tiers) > 1 and tier_name is None:
         tier_names = [tier['tier_name'] for tier in tiers]
         click.secho("More than one tier found. Please specify which one to use: {}.".format(
@@ -82,32 +117,32 @@ def _get_config_and_tier(tier_name=None):
         sys.exit(1)
 
     if tier_name:
-        tier = ts.get_table('tiers').get({'tier_name': tier_name})
-        if not tier:
+        tiers = [tier for tier in tiers if tier['tier_name'] == tier_name]
+        if not tiers:
             click.secho("Tier {} not found.".format(tier_name), fg='red', bold=True)
             sys.exit(1)
-    else:
-        tier = tiers[0]
 
-    return ts, tier
-
-
-def fold_tags(tags):
-    """Fold boto3 resource tags array into a dictionary."""
-    return {tag['Key']: tag['Value'] for tag in tags}
+    return tiers[:1]
 
 
 @cli.command()
-@click.option('--show-all', '-a', is_flag=True)
+@click.option('--show-all', '-a', is_flag=True,
+    help="Show all stacks, not only the ones belonging to the tier.")
+@click.option('--all-tiers', '-A', is_flag=True,
+    help="Show stacks for all tiers in the config.")
+@click.option('--format', '-f', 'output_format', type=click.Choice(['table', 'jsonl']), default='table',
+    help="Output format, 'jsonl' writes one json object per stack.")
+@click.option('--scan', is_flag=True,
+    help="Find drift stacks by scanning all stacks instead of using the tagging API.")
 @pass_globals
-def info(ctx, show_all):
+def info(ctx, show_all, all_tiers, output_format, scan):
     """Show information on templates, stacks and tiers."""
-    ts, tier = _get_config_and_tier(ctx.obj.tier_name)
+    tiers = _get_tiers(ctx.obj.tier_name, all_tiers, ctx.obj.cache)
 
     #hd = ['template_name', '']
     #print "template code", [t().template_name for t in templater.export]
 
-    _list_stacks(tier, show_all)
+    _list_stacks(tiers, show_all, output_format, scan, ctx.obj.cache)
 
 
 def fit(text, max_len=35, strip=True, **ansi):
@@ -125,59 +160,719 @@ def fit(text, max_len=35, strip=True, **ansi):
     return text
 
 
-def _list_stacks(tier, show_all):
+# Max number of regions queried concurrently
+MAX_REGION_WORKERS = 8
+
+# Stack listing columns and their max width
+STACK_COLUMNS = [
+    ("Stack Name", 35),
+    ("Creation Time", 19),
+    ("Stack Status", 35),
+    ("Description", 35),
+    ("Tier", 20),
+    ("Template", 20),
+    ("Region", 14),
+]
+
+
+def _describe_stacks(region, out_queue):
+    """Put pages of stacks in 'region' on 'out_queue' as they arrive."""
+    try:
+        from aws import get_client
+        cfn_client = get_client('cloudformation', region)
+        for page in cfn_client.get_paginator('describe_stacks').paginate():
+            out_queue.put((region, page['Stacks']))
+    except Exception as e:
+        out_queue.put((region, e))
+    finally:
+        out_queue.put((region, None))
+
+
+def _describe_tagged_stacks(region, out_queue, tier_names):
+    """
+    Put pages of drift stacks for 'tier_names' in 'region' on 'out_queue' as they arrive.
+    The Resource Groups Tagging API is asked for the tags of the drift stacks and they
+    are joined by ARN with the stack summaries from 'list_stacks'. That's two paged
+    calls, instead of describing each stack or every stack in the account.
+    """
+    try:
+        from aws import get_client
+        tagging_client = get_client('resourcegroupstaggingapi', region)
+        cfn_client = get_client('cloudformation', region)
+        pages = tagging_client.get_paginator('get_resources').paginate(
+            TagFilters=[
+                {'Key': 'drift:tier', 'Values': sorted(tier_names)},
+                {'Key': 'drift:template'},
+            ],
+            ResourceTypeFilters=['cloudformation:stack'],
+        )
+        tags = {r['ResourceARN']: r['Tags'] for page in pages for r in page['ResourceTagMappingList']}
+        if not tags:
+            return
+
+        # The tagging API can lag behind, leave out stacks that are already deleted
+        statuses = cfn_client.meta.service_model.shape_for('StackStatus').enum
+        pages = cfn_client.get_paginator('list_stacks').paginate(
+            StackStatusFilter=[status for status in statuses if status != 'DELETE_COMPLETE'])
+        for page in pages:
+            found = [{
+                'StackId': s['StackId'],
+                'StackName': s['StackName'],
+                'CreationTime': s['CreationTime'],
+                'StackStatus': s['StackStatus'],
+                'Description': s.get('TemplateDescription', ''),
+                'Tags': tags[s['StackId']],
+            } for s in page['StackSummaries'] if s['StackId'] in tags]
+            if found:
+                out_queue.put((region, found))
+    except Exception as e:
+        out_queue.put((region, e))
+    finally:
+        out_queue.put((region, None))
+
+
+def _iter_stacks(regions, tier_names=None):
+    """
+    Yields (region, stack) for all stacks in 'regions'. The regions are paged through
+    concurrently and stacks are yielded as soon as their page arrives.
+    If 'tier_names' is set, only drift stacks belonging to those tiers are looked up.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    out_queue = queue.Queue()
+    with ThreadPoolExecutor(max_workers=min(len(regions), MAX_REGION_WORKERS)) as executor:
+        for region in regions:
+            if tier_names:
+                executor.submit(_describe_tagged_stacks, region, out_queue, tier_names)
+            else:
+                executor.submit(_describe_stacks, region, out_queue)
+
+        pending = len(regions)
+        while pending:
+            region, stacks = out_queue.get()
+            if stacks is None:
+                pending -= 1
+            elif isinstance(stacks, Exception):
+                raise stacks
+            else:
+                for s in stacks:
+                    yield region, s
+
+
+def _get_account_id(cache, region):
+    """
+    Returns the AWS account id of the current credentials. It's cached under the profile
+    and access key named in the environment, so a cached listing makes no AWS calls.
+    """
+    key = (
+        'account',
+        os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE') or 'default',
+        os.environ.get('AWS_ACCESS_KEY_ID') or '',
+    )
+    account_id = cache.get(*key)
+    if account_id is None:
+        from aws import get_account_id
+        account_id = get_account_id(region)
+        cache.set(account_id, *key)
+    return account_id
+
+
+def _iter_stack_summaries(regions, tier_names=None, cache=None):
+    """
+    Yields stack summaries for all stacks in 'regions', see '_iter_stacks'.
+    Summaries are read from 'cache' if possible, keyed by AWS account, region and
+    'tier_names'.
+    """
+    if cache and not cache.ttl:
+        cache = None  # Disabled, no need to look up the account
+    account_id = _get_account_id(cache, regions[0]) if cache else None
+    scope = ','.join(sorted(tier_names)) if tier_names else 'all'
+    fetch = []
+    for region in regions:
+        cached = cache.get('stacks', account_id, region, scope) if cache else None
+        if cached is None:
+            fetch.append(region)
+        else:
+            for summary in cached:
+                yield summary
+
+    if not fetch:
+        return
+
+    collected = {region: [] for region in fetch}
+    for region, s in _iter_stacks(fetch, tier_names):
+        summary = _stack_summary(region, s)
+        if cache:
+            collected[region].append(summary)
+        yield summary
+
+    if cache:
+        for region, summaries in collected.items():
+            cache.set(summaries, 'stacks', account_id, region, scope)
+
+
+def _stack_summary(region, s):
+    """Returns a flat, json serializable summary of stack 's'."""
+    from stacks import fold_tags
+    tags = fold_tags(s['Tags'])
+    return {
+        'stack_name': s['StackName'],
+        'creation_time': str(s['CreationTime']).split('.')[0],
+        'stack_status': s['StackStatus'],
+        'description': s.get('Description', ''),
+        'tier': tags.get('drift:tier'),
+        'template': tags.get('drift:template'),
+        'region': region,
+    }
+
+
+def _format_row(cells, widths):
+    """Format 'cells' as a markdown table row, padding each cell to its column width."""
+    padded = [cell + ' ' * (width - len(click.unstyle(cell))) for cell, width in zip(cells, widths)]
+    return '| ' + ' | '.join(padded) + ' |'
+
+
+def _list_stacks(tiers, show_all, output_format='table', scan=False, cache=None):
     # List out all template types
 
     # List out all stacks
     # The stacks have tag 'drift:template=template name'
-    cfn_client = boto3.client('cloudformation', region_name=tier['aws']['region'])
-    stacks = cfn_client.describe_stacks()
-
-    hd = ["Stack Name", "Creation Time", "Stack Status", "Description", "Tier", "Template"]
-    hd = [fit(h, bold=True) for h in hd]  # Make bold
-
-    li = []
-    for s in stacks['Stacks']:
-        tags = fold_tags(s['Tags'])
+    # The tiers may live in different regions, which are all queried concurrently.
+    # Rows are written out as the pages arrive so there is no need to hold on to the
+    # whole list, hence the fixed column widths.
+    tier_names = set(tier['tier_name'] for tier in tiers)
+    regions = sorted(set(tier['aws']['region'] for tier in tiers))
+
+    columns = STACK_COLUMNS if len(regions) > 1 else STACK_COLUMNS[:-1]
+    widths = [width for title, width in columns]
+    hd = [fit(title, max_len, bold=True) for title, max_len in columns]  # Make bold
+
+    if output_format == 'table':
+        click.secho("Stacks on {}:".format(', '.join(sorted(tier_names))), bold=True)
+
+    # Unless all stacks are requested, let the tagging API find the drift stacks
+    count = 0
+    discover_by_tags = not show_all and not scan
+    summaries = _iter_stack_summaries(regions, tier_names if discover_by_tags else None, cache)
+    for summary in summaries:
         if not show_all:
-            if 'drift:tier' not in tags or 'drift:template' not in tags:
+            if summary['tier'] is None or summary['template'] is None:
                 continue
+            if summary['tier'] not in tier_names:
+                continue
+
+        count += 1
+        if output_format == 'jsonl':
+            click.echo(json.dumps(summary, sort_keys=True))
+            continue
 
-        if s['StackStatus'].endswith('PROGRESS'):
+        if summary['stack_status'].endswith('PROGRESS'):
             status_color = 'yellow'
-        elif s['StackStatus'].endswith('FAILED'):
+        elif summary['stack_status'].endswith('FAILED'):
             status_color = 'red'
         else:
             status_color = 'green'
 
         row = [
-            fit(s['StackName']),
-            fit(str(s['CreationTime']).split('.')[0]),
-            fit(s['StackStatus'], fg=status_color),
-            fit(s.get('Description', '')),
-            fit(tags.get('drift:tier')),
-            fit(tags.get('drift:template')),
+            fit(summary['stack_name'], widths[0]),
+            fit(summary['creation_time'], widths[1]),
+            fit(summary['stack_status'], widths[2], fg=status_color),
+            fit(summary['description'], widths[3]),
+            fit(summary['tier'], widths[4]),
+            fit(summary['template'], widths[5]),
         ]
+        if len(regions) > 1:
+            row.append(fit(summary['region'], widths[6]))
 
-        li.append(row)
+        if count == 1:
+            click.secho(_format_row(hd, widths))
+            click.secho('|' + '|'.join('-' * (width + 2) for width in widths) + '|')
+        click.secho(_format_row(row, widths))
 
-    click.secho("Stacks on {}:".format(tier['tier_name']), bold=True)
-    if not li:
+    if not count and output_format == 'table':
         click.secho("Note! No stack found!. Use --show-all to see all stacks.")
+
+
+@cli.command()
+@click.argument('template-names', nargs=-1)
+@click.option('--out-dir', '-o', type=click.Path(file_okay=False),
+    help="Where to write the templates, default is the templates folder.")
+@click.option('--force', '-f', is_flag=True,
+    help="Render templates even if the build cache says they are up to date.")
+def build(template_names, out_dir, force):
+    """Render templates to json files.\n
+    TEMPLATE_NAMES is one or more of the exported templates, all of them if omitted.
+    Files are only written if their content changed. The export/import indexes of
+    all templates are checked for dangling imports and export name collisions.
+    """
+    import templater
+    from validation import check_exports
+    try:
+        results = templater.build_templates(template_names, out_dir, force)
+    except RuntimeError as e:
+        click.secho(str(e), fg='red', bold=True)
+        sys.exit(1)
+
+    for name, filename, status in results:
+        if status == 'written':
+            click.secho("Wrote {}".format(filename), fg='green')
+        elif status == 'cached':
+            click.secho("Up to date {}".format(filename))
+        else:
+            click.secho("Unchanged {}".format(filename))
+
+    try:
+        problems = check_exports(templater.load_indexes(out_dir))
+    except (IOError, OSError):
+        click.secho("Export check skipped, build all templates to run it.", fg='yellow')
+        return
+    for problem in problems:
+        click.secho(problem, fg='red', bold=True)
+    if problems:
+        sys.exit(1)
+
+
+def _parse_parameters(params):
+    """Returns a dict from a list of 'key=value' strings."""
+    ret = {}
+    for param in params:
+        if '=' not in param:
+            click.secho("Parameter '{}' must be on the form key=value.".format(param), fg='red', bold=True)
+            sys.exit(1)
+        key, value = param.split('=', 1)
+        ret[key] = value
+    return ret
+
+
+def _get_stack_parameters(template, tier, overrides=None):
+    """
+    Returns a dict of stack parameters for 'template' on 'tier'.
+    StackGroup and TierName are the tier name, other parameters are read from the
+    'stack_parameters' dict in the tier's 'aws' config and then from 'overrides'.
+    """
+    values = {
+        'StackGroup': tier['tier_name'],
+        'TierName': tier['tier_name'],
+    }
+    values.update(tier['aws'].get('stack_parameters', {}))
+    values.update(overrides or {})
+
+    params = {}
+    missing = []
+    for name, parameter in template.t.parameters.items():
+        if name in values:
+            params[name] = str(values[name])
+        elif 'Default' not in parameter.properties:
+            missing.append(name)
+
+    if missing:
+        click.secho("Missing parameters for template '{}': {}. Add them to 'stack_parameters' "
+            "in the tier config or use --parameter.".format(template.template_name, ', '.join(missing)),
+            fg='red', bold=True)
+        sys.exit(1)
+
+    return params
+
+
+def _print_event(e):
+    """Print out a boto3 stack event on one line."""
+    status = e['ResourceStatus']
+    if status.endswith('FAILED'):
+        color = 'red'
+    elif status.endswith('PROGRESS'):
+        color = 'yellow'
     else:
-        click.secho(tabulate(li, headers=hd, tablefmt='github'))
+        color = 'green'
+    click.echo("{} {} {} {} {}".format(
+        e['Timestamp'].strftime('%H:%M:%S'),
+        fit(status, 35, fg=color),
+        e['ResourceType'],
+        e['LogicalResourceId'],
+        e.get('ResourceStatusReason', ''),
+    ))
 
 
 @cli.command()
-@click.argument('stack-name')
+@click.argument('template-name')
+@click.option('--stack-name', '-s',
+    help="Name of the stack, default is <tier name>-<template name>.")
+@click.option('--parameter', '-p', 'params', multiple=True,
+    help="Stack parameter on the form key=value.")
+@click.option('--yes', '-y', is_flag=True,
+    help="Execute the change set without asking.")
+@click.option('--no-execute', is_flag=True,
+    help="Only create and show the change set.")
+@click.option('--force', '-f', is_flag=True,
+    help="Create a change set even if the deployed template and parameters are unchanged.")
+@pass_globals
+def update(ctx, template_name, stack_name, params, yes, no_execute, force):
+    """Create or update a stack.\n
+    A change set for TEMPLATE_NAME is created and shown. It is executed on confirmation.
+    """
+    from tabulate import tabulate
+    from aws import get_client
+    import templater
+    import stacks
+    import templatediff
+    from validation import validate_drift_template
+
+    try:
+        template = templater.get_export_class(template_name)()
+    except RuntimeError as e:
+        click.secho(str(e), fg='red', bold=True)
+        sys.exit(1)
+
+    # Stacks are changed using the tier config, so it's never read from the cache
+    tier = _get_tiers(ctx.obj.tier_name)[0]
+    stack_name = stack_name or '{}-{}'.format(tier['tier_name'], template.template_name)
+    stack_params = _get_stack_parameters(template, tier, _parse_parameters(params))
+    tags = {
+        'drift:tier': tier['tier_name'],
+        'drift:template': template.template_name,
+    }
+
+    # Catch template mistakes before CloudFormation does
+    problems = validate_drift_template(template, stack_params)
+    for problem in problems:
+        click.secho(problem, fg='red', bold=True)
+    if problems:
+        sys.exit(1)
+
+    cfn_client = get_client('cloudformation', tier['aws']['region'])
+    template_body = templater.to_compact_json(template.t)
+
+    # Compare with what's deployed to skip no-op updates without any mutating calls
+    deployed = stacks.get_deployed(cfn_client, stack_name)
+    if deployed and deployed[3] in stacks.FAILED_CREATE_STATUSES:
+        click.secho("Stack {} is {} and must be deleted before it can be deployed.".format(
+            stack_name, deployed[3]), fg='red', bold=True)
+        sys.exit(1)
+    if not force:
+        if stacks.is_up_to_date(deployed, template_body, stack_params, tags):
+            click.secho("Stack {} is up to date.".format(stack_name), fg='green')
+            return
+        if deployed and ctx.obj.verbose:
+            for line in templatediff.diff_templates(deployed[0], template_body):
+                click.echo(line)
+            local_params = templatediff.with_defaults(template_body, stack_params)
+            for name, (old, new) in sorted(templatediff.diff_parameters(deployed[1], local_params).items()):
+                click.echo("Parameter {}: {} -> {}".format(name, old, new))
+
+    click.secho("Creating change set for stack {} in {}...".format(stack_name, tier['aws']['region']))
+    change_set_id = stacks.create_change_set(
+        cfn_client, stack_name, template_body, stack_params, tags, tier['aws'].get('template_bucket'))
+    if change_set_id is None:
+        click.secho("No changes for stack {}.".format(stack_name), fg='green')
+        return
+
+    description = stacks.wait_for_change_set(cfn_client, change_set_id)
+    if stacks.is_empty_change_set(description):
+        click.secho("No changes for stack {}.".format(stack_name), fg='green')
+        stacks.delete_change_set(cfn_client, change_set_id)
+        return
+    if description['Status'] != 'CREATE_COMPLETE':
+        click.secho("Change set failed: {}".format(description.get('StatusReason')), fg='red', bold=True)
+        sys.exit(1)
+
+    colors = {'True': 'red', 'Conditional': 'yellow'}
+    rows = [
+        [fit(cell, 50, fg=colors.get(cell)) if i == 4 else fit(cell, 50) for i, cell in enumerate(row)]
+        for row in stacks.get_change_rows(description)
+    ]
+    hd = [fit(h, bold=True) for h in ["Action", "Logical ID", "Physical ID", "Resource Type", "Replacement"]]
+    click.secho("Changes for stack {}:".format(stack_name), bold=True)
+    click.secho(tabulate(rows, headers=hd, tablefmt='github'))
+
+    if no_execute:
+        click.secho("Change set {} not executed.".format(change_set_id))
+        return
+    if not yes and not click.confirm("Execute change set?"):
+        stacks.delete_change_set(cfn_client, change_set_id)
+        click.secho("Change set deleted.")
+        return
+
+    seen = stacks.mark_events(cfn_client, stack_name)
+    stacks.execute_change_set(cfn_client, change_set_id)
+    status = stacks.wait_for_stack(cfn_client, stack_name, _print_event, seen)
+    ctx.obj.cache.clear('stacks')  # The cached stack summaries are out of date
+    if stacks.is_success_status(status):
+        click.secho("Stack {} is {}.".format(stack_name, status), fg='green', bold=True)
+    else:
+        click.secho("Stack {} is {}.".format(stack_name, status), fg='red', bold=True)
+        sys.exit(1)
+
+
+def _deploy_tier(tier, deps, bodies, stack_params, cfn_client, force, max_workers, report, on_event):
+    """
+    Deploy the templates in 'deps' to 'tier' in dependency order, see 'orchestrate'.
+    'bodies' and 'stack_params' are template bodies and stack parameters keyed by template
+    name. Progress is passed to 'report(stack_name, text, ok)', where 'ok' is None while
+    a stack is being deployed, and stack events to
+    'on_event(stack_name, event)'. Returns a dict of template name to DeployResult.
+    """
+    import stacks
+    from orchestrate import deploy_all
+
+    def deploy_template(name):
+        stack_name = '{}-{}'.format(tier['tier_name'], name)
+        tags = {'drift:tier': tier['tier_name'], 'drift:template': name}
+        report(stack_name, "Deploying...", None)
+        return stacks.deploy_stack(
+            cfn_client, stack_name, bodies[name], stack_params[name], tags,
+            lambda e: on_event(stack_name, e), force, tier['aws'].get('template_bucket'),
+        )
+
+    def on_result(result):
+        stack_name = '{}-{}'.format(tier['tier_name'], result.name)
+        text = result.status if result.ok else "{} {}".format(result.status, result.error)
+        report(stack_name, text, result.ok)
+
+    return deploy_all(deps, deploy_template, max_workers, on_result)
+
+
+@cli.command()
+@click.argument('template-names', nargs=-1)
+@click.option('--parameter', '-p', 'params', multiple=True,
+    help="Stack parameter on the form key=value, applies to all templates.")
+@click.option('--yes', '-y', is_flag=True,
+    help="Deploy without asking.")
+@click.option('--force', '-f', is_flag=True,
+    help="Create change sets even if the deployed templates and parameters are unchanged.")
+@click.option('--max-workers', '-w', type=int, default=4,
+    help="Max number of stacks deployed at the same time within a tier.")
+@click.option('--all-tiers', '-A', is_flag=True,
+    help="Deploy to all tiers in the config.")
+@click.option('--concurrency', '-n', type=int, default=4,
+    help="Max number of tiers deployed at the same time.")
+@click.option('--rate', type=float, default=5.0,
+    help="Max CloudFormation API calls per second in each region.")
+@pass_globals
+def deploy(ctx, template_names, params, yes, force, max_workers, all_tiers, concurrency, rate):
+    """Create or update all the stacks of a tier.\n
+    TEMPLATE_NAMES is one or more of the exported templates, all of them if omitted.
+    Stacks are deployed in dependency order, as defined by the exported and imported
+    values of the templates, and independent stacks are deployed concurrently.
+    With --all-tiers, the stacks are deployed to every tier in the config, using the
+    tier's 'stack_parameters' config.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from tabulate import tabulate
+    from aws import DEFAULT_POOL_SIZE, get_client
+    import templater
+    from orchestrate import DeployResult, get_dependencies, get_waves
+    from poll import RateLimiter
+    from progress import Progress
+    from validation import check_exports, validate_templates
+
+    try:
+        classes = [templater.get_export_class(name) for name in template_names] or templater.export
+    except RuntimeError as e:
+        click.secho(str(e), fg='red', bold=True)
+        sys.exit(1)
+
+    # Stacks are changed using the tier config, so it's never read from the cache
+    tiers = _get_tiers(ctx.obj.tier_name, all_tiers)
+    overrides = _parse_parameters(params)
+    templates = {}
+    for c in classes:
+        template = c()
+        templates[template.template_name] = template
+    deps = get_dependencies(templates.values())
+
+    # All exports must be accounted for, not only the ones of the templates being deployed
+    problems = check_exports([c().get_index() for c in templater.export])
+    for problem in problems:
+        click.secho(problem, fg='red', bold=True)
+    if problems:
+        sys.exit(1)
+
+    tier_names = [tier['tier_name'] for tier in tiers]
+    # Resolve all parameters and validate the templates with them up front so mistakes
+    # are caught before anything is deployed
+    stack_params = {
+        tier['tier_name']: {name: _get_stack_parameters(t, tier, overrides) for name, t in templates.items()}
+        for tier in tiers
+    }
+    for tier_name in tier_names:
+        problems = validate_templates(templates.values(), stack_params[tier_name])
+        for problem in problems:
+            click.secho("{}: {}".format(tier_name, problem), fg='red', bold=True)
+        if problems:
+            sys.exit(1)
+
+    click.secho("Deployment plan for {}:".format(', '.join(tier_names)), bold=True)
+    for i, wave in enumerate(get_waves(deps)):
+        click.secho("  {}: {}".format(i + 1, ', '.join('<tier>-{}'.format(name) for name in wave)))
+    if not yes and not click.confirm("Deploy?"):
+        return
+
+    bodies = {name: templater.to_compact_json(t.t) for name, t in templates.items()}
+
+    # One client and rate limiter per region, shared by all tiers in that region
+    cfn_clients = {}
+    pool_size = max(DEFAULT_POOL_SIZE, concurrency * max_workers)
+    for region in set(tier['aws']['region'] for tier in tiers):
+        cfn_clients[region] = get_client('cloudformation', region, max_pool_connections=pool_size)
+        RateLimiter(rate).attach(cfn_clients[region])
+
+    if len(tiers) == 1:
+        def report(stack_name, text, ok):
+            click.secho("{}: {}".format(stack_name, text), fg={True: 'green', False: 'red'}.get(ok))
+
+        def on_event(stack_name, e):
+            click.echo("{}: ".format(fit(stack_name, 20, bold=True)), nl=False)
+            _print_event(e)
+
+        tier = tiers[0]
+        results = {tier['tier_name']: _deploy_tier(
+            tier, deps, bodies, stack_params[tier['tier_name']], cfn_clients[tier['aws']['region']],
+            force, max_workers, report, on_event,
+        )}
+    else:
+        progress = Progress(tier_names)
+        for tier_name in tier_names:
+            progress.update(tier_name, "Waiting...")
+
+        def deploy_tier(tier):
+            tier_name = tier['tier_name']
+
+            def report(stack_name, text, ok):
+                progress.update(tier_name, "{}: {}".format(stack_name, text))
+
+            def on_event(stack_name, e):
+                progress.update(tier_name, "{}: {} {}".format(stack_name, e['ResourceStatus'], e['LogicalResourceId']))
+
+            try:
+                tier_results = _deploy_tier(
+                    tier, deps, bodies, stack_params[tier_name], cfn_clients[tier['aws']['region']],
+                    force, max_workers, report, on_event,
+                )
+            except Exception as e:
+                progress.update(tier_name, "Failed: {}".format(e))
+                return {'*': DeployResult('*', 'FAILED', e)}
+            failed = [r for r in tier_results.values() if not r.ok]
+            progress.update(tier_name, "Done, {} stacks ok, {} failed.".format(
+                len(tier_results) - len(failed), len(failed)))
+            return tier_results
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = dict(zip(tier_names, executor.map(deploy_tier, tiers)))
+
+        rows = []
+        for tier_name in tier_names:
+            for name, result in sorted(results[tier_name].items()):
+                rows.append([tier_name, name, fit(result.status, fg='green' if result.ok else 'red'),
+                             fit(result.error or '', 60)])
+        hd = [fit(h, bold=True) for h in ["Tier", "Template", "Status", "Error"]]
+        click.secho(tabulate(rows, headers=hd, tablefmt='github'))
+
+    ctx.obj.cache.clear('stacks')  # The cached stack summaries are out of date
+    if not all(r.ok for tier_results in results.values() for r in tier_results.values()):
+        sys.exit(1)
+
+
+WATCH_COLORS = ['cyan', 'magenta', 'blue', 'yellow', 'green', 'white']
+
+
+@cli.command()
+@click.argument('stack-names', nargs=-1)
+@click.option('--max-workers', '-w', type=int, default=8,
+              help="Maximum number of concurrent AWS calls.")
 @pass_globals
-def update(ctx, stack_name):
-    """Create or update a stack.
+def watch(ctx, stack_names, max_workers):
+    """Follow the events of many stacks at once.\n
+    STACK_NAMES is one or more stack names, or all stacks of the tier that have an
+    operation in progress if omitted. Events of all stacks are printed as they arrive,
+    prefixed with the stack name, until no stack has an operation in progress.
+    """
+    from tabulate import tabulate
+    from aws import get_client
+    from watch import watch_stacks
+
+    tier = _get_tiers(ctx.obj.tier_name, cache=ctx.obj.cache)[0]
+    region = tier['aws']['region']
+    if not stack_names:
+        stack_names = [
+            summary['stack_name']
+            for summary in _iter_stack_summaries([region], [tier['tier_name']])
+            if summary['stack_status'].endswith('_IN_PROGRESS')
+        ]
+        if not stack_names:
+            click.secho("No stacks in tier {} have an operation in progress.".format(tier['tier_name']))
+            return
+
+    # A single client, and so a single connection pool, for all stacks
+    cfn_client = get_client('cloudformation', region, max_pool_connections=max_workers)
+
+    width = max(len(stack_name) for stack_name in stack_names)
+    colors = {stack_name: WATCH_COLORS[i % len(WATCH_COLORS)] for i, stack_name in enumerate(stack_names)}
+
+    def on_event(stack_name, e):
+        click.echo("{}: ".format(click.style(stack_name.ljust(width), fg=colors[stack_name], bold=True)), nl=False)
+        _print_event(e)
+
+    click.secho("Watching {} stacks in {}...".format(len(stack_names), region), bold=True)
+    watches = watch_stacks(cfn_client, stack_names, on_event, max_workers)
+
+    rows = []
+    for w in watches:
+        ok = 'FAILED' not in w.status and 'ROLLBACK' not in w.status
+        rows.append([click.style(w.stack_name, fg=colors[w.stack_name]), fit(w.status, fg='green' if ok else 'red'),
+                     w.events, "{:.0f}s".format(w.duration)])
+    hd = [fit(h, bold=True) for h in ["Stack", "Status", "Events", "Time"]]
+    click.secho(tabulate(rows, headers=hd, tablefmt='github'))
+
 
-    ia m temporoary
+@cli.command()
+@click.argument('stack-name')
+@click.option('--width', '-w', type=int, default=60,
+              help="Width of the chart in characters.")
+@pass_globals
+def profile(ctx, stack_name, width):
+    """Show where the time of the last operation on a stack went.\n
+    The duration of each resource is shown on a time line, with the critical path,
+    the chain of dependencies that determined the total time, highlighted.
     """
-    print ("stack name: {}".format(stack_name))
+    from aws import get_client
+    import stacks
+    import stackprofile
+    import templatediff
+
+    tier = _get_tiers(ctx.obj.tier_name, cache=ctx.obj.cache)[0]
+    cfn_client = get_client('cloudformation', tier['aws']['region'])
+    if stacks.get_stack(cfn_client, stack_name) is None:
+        click.secho("Stack '{}' not found.".format(stack_name), fg='red', bold=True)
+        sys.exit(1)
 
+    events = stackprofile.get_operation_events(cfn_client, stack_name)
+    timings = stackprofile.get_timings(events, stack_name)
+    if not timings:
+        click.secho("No resources in the last operation on stack '{}'.".format(stack_name))
+        return
+
+    response = cfn_client.get_template(StackName=stack_name, TemplateStage='Original')
+    template = templatediff.load_template(response['TemplateBody']) or {}  # yaml is not supported
+    critical_path = stackprofile.get_critical_path(timings, stackprofile.get_dependencies(template))
+    critical = set(t.logical_id for t in critical_path)
+
+    first, last = events[0], events[-1]
+    click.secho("{}: {} at {} to {}, {:.0f}s".format(
+        stack_name, first['ResourceStatus'], first['Timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        last['ResourceStatus'], (last['Timestamp'] - first['Timestamp']).total_seconds()),
+        bold=True)
+    name_width = min(max(len(t.logical_id) for t in timings), 35)
+    for t, bar in stackprofile.format_gantt(timings, width):
+        duration = "{:>5.0f}s".format(t.duration) if t.end else "  ...."
+        line = "{} |{}| {} {}".format(fit(t.logical_id, name_width).ljust(name_width), bar, duration, t.resource_type)
+        if t.status and 'FAILED' in t.status:
+            click.secho(line, fg='red')
+        elif t.logical_id in critical:
+            click.secho(line, fg='yellow', bold=True)
+        else:
+            click.echo(line)
+
+    click.secho("\nCritical path:", bold=True)
+    for t in critical_path:
+        click.echo("  {:>5.0f}s {} ({})".format(t.duration, t.logical_id, t.resource_type))
 
 
 @cli.command()
@@ -214,6 +909,15 @@ def pretty(ob, lexer=None):
     if lexer == 'json':
         ob = json.dumps(ob, indent=4, sort_keys=True)
 
+    # pygments is optional for now
+    try:
+        from pygments import highlight
+        from pygments.lexers import get_lexer_by_name
+        from pygments.formatters import get_formatter_by_name
+        got_pygments = True
+    except ImportError:
+        got_pygments = False
+
     if got_pygments:
         lexerob = get_lexer_by_name(lexer)
         formatter = get_formatter_by_name(PRETTY_FORMATTER, style=PRETTY_STYLE)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+'''
+Render all registered CloudFormation templates.
+
+The templates in 'templater.export' are built into the templates folder by
+'templater.build_templates' and the stand-alone template scripts (vpc.py, iam.py,
+asgtest.py) are written to <script name>.json next to this file. Templates are written
+minified, with an indented copy in <name>.pretty.json for review. Templates that don't
+pass validation, see validation.py, are not written. The scripts are rendered in this
+process so troposphere is only imported once, or spread over a process pool with
+--jobs.
+
+To use:
+
+python generate.py                  # Render everything
+python generate.py drift-cfn-vpc    # Render only one template
+python generate.py -j 4 --force     # Re-render everything on 4 processes
+'''
+import argparse
+import importlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import templater
+from buildcache import BuildCache, source_key
+from validation import check_exports, validate_drift_template, validate_template
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Stand-alone template scripts. Each of them has a 'get_template()' function.
+SCRIPTS = ['vpc', 'iam', 'asgtest']
+
+
+def get_generators():
+    """Returns a list of (name, module name, file name) for all registered generators."""
+    li = []
+    for c in templater.export:
+        name = 'drift-cfn-{}'.format(c.__name__.lower())
+        li.append((name, c.__module__, os.path.join(templater.TEMPLATES_DIR, name + '.json')))
+    for script in SCRIPTS:
+        li.append((script, script, os.path.join(HERE, script + '.json')))
+    return li
+
+
+def render(name, module_name):
+    """
+    Render generator 'name' from 'module_name' and return (name, body, pretty body,
+    construct time, render time, index, problems). 'body' is minified, 'pretty body'
+    indented. 'index' is the export/import index for templates in 'templater.export'
+    and None for the others. 'problems' is the list of validation problems, if there
+    are any the template is not rendered and 'body' and 'pretty body' are None.
+    Nothing is written, 'generate' uses this for the stand-alone scripts only.
+    This is run in the worker processes so it must be picklable.
+    """
+    start = time.time()
+    index = drift_template = None
+    if module_name == templater.__name__:
+        drift_template = templater.get_export_class(name[len('drift-cfn-'):])()
+        template = drift_template.t
+        index = drift_template.get_index()
+    else:
+        template = importlib.import_module(module_name).get_template()
+    constructed = time.time()
+
+    # Validation is not part of either timing
+    if drift_template is not None:
+        problems = validate_drift_template(drift_template)
+    else:
+        try:
+            problems = ["{}: {}".format(name, p) for p in validate_template(template.to_dict())]
+        except (ValueError, TypeError, AttributeError) as e:
+            problems = ["{}: {}".format(name, e)]
+    if problems:
+        return name, None, None, constructed - start, 0.0, index, problems
+
+    render_start = time.time()
+    body = templater.to_compact_json(template)
+    render_time = time.time() - render_start
+    return name, body, template.to_json(), constructed - start, render_time, index, problems
+
+
+def generate(names=None, jobs=1, force=False):
+    """
+    Render the generators in 'names', or all of them, skipping the ones the build
+    cache says are up to date unless 'force' is set. The templates in
+    'templater.export' are left to 'templater.build_templates'.
+    Returns a list of (name, file name, status, milliseconds, size) and a list of
+    validation problems. Templates with problems are not written.
+    """
+    generators = get_generators()
+    if names:
+        unknown = set(names) - set(name for name, module_name, filename in generators)
+        if unknown:
+            raise RuntimeError("Unknown generator(s): {}. Available generators: {}".format(
+                ', '.join(sorted(unknown)), ', '.join(name for name, module_name, filename in generators)))
+        generators = [g for g in generators if g[0] in names]
+
+    results = []
+    problems = []
+    scripts = []
+    for name, module_name, filename in generators:
+        if module_name != templater.__name__:
+            scripts.append((name, module_name, filename))
+            continue
+        start = time.time()
+        try:
+            [(_, filename, status)] = templater.build_templates([name[len('drift-cfn-'):]], force=force)
+        except RuntimeError as e:
+            problems.extend(str(e).splitlines())
+            status = 'invalid'
+        size = os.path.getsize(filename) if status != 'invalid' else 0
+        results.append((name, filename, status, (time.time() - start) * 1000.0, size))
+
+    cache = BuildCache(HERE)
+    todo = []
+    for name, module_name, filename in scripts:
+        key = source_key(name, [module_name])
+        complete = os.path.exists(templater.get_pretty_filename(filename))
+        if not force and complete and cache.is_fresh(name, key, filename):
+            results.append((name, filename, 'cached', 0.0, os.path.getsize(filename)))
+        else:
+            todo.append((name, module_name, filename, key))
+
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(render, name, module_name) for name, module_name, filename, key in todo]
+            rendered = [future.result() for future in futures]
+    else:
+        rendered = [render(name, module_name) for name, module_name, filename, key in todo]
+
+    for (name, module_name, filename, key), result in zip(todo, rendered):
+        _, body, pretty_body, construct_time, render_time, _, template_problems = result
+        milliseconds = (construct_time + render_time) * 1000.0
+        if template_problems:
+            problems.extend(template_problems)
+            results.append((name, filename, 'invalid', milliseconds, 0))
+            continue
+        changed = templater.write_if_changed(filename, body)
+        changed = templater.write_if_changed(templater.get_pretty_filename(filename), pretty_body) or changed
+        cache.update(name, key, filename)
+        results.append((name, filename, 'written' if changed else 'unchanged', milliseconds, len(body)))
+
+    cache.save()
+    return results, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs='*',
+                        help="generators to render, all of them if omitted")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of processes to render on (default %(default)s)")
+    parser.add_argument("-f", "--force", action='store_true',
+                        help="render even if the build cache says the file is up to date")
+    values = parser.parse_args()
+
+    start = time.time()
+    try:
+        results, problems = generate(values.names, values.jobs, values.force)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
+
+    print("{:<16} {:<10} {:>10} {:>10}".format("Template", "Status", "ms", "Bytes"))
+    for name, filename, status, milliseconds, size in results:
+        print("{:<16} {:<10} {:>10.1f} {:>10}".format(name, status, milliseconds, size))
+    print("done in {:.1f} ms.".format((time.time() - start) * 1000.0))
+
+    try:
+        problems += check_exports(templater.load_indexes())
+    except (IOError, OSError):
+        pass  # Not everything has been built yet
+    for problem in problems:
+        print(problem)
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -434,4 +434,10 @@ t.add_output([
 ])
 
 
-print t.to_json()
+def get_template():
+    """Returns the template, used by generate.py."""
+    return t
+
+
+if __name__ == '__main__':
+    print(get_template().to_json())
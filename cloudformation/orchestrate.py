@@ -0,0 +1,115 @@
+'''
+Dependency aware deployment of the templates that make up a tier.
+
+The templates are wired together through exported values (see
+'DriftTemplate.export_value' and 'DriftTemplate.import_value') so a stack can only be
+deployed once the stacks it imports from are in place. The dependency graph is built
+from the exports and imports of each template and stacks are deployed as soon as all
+their dependencies are done, independent stacks running concurrently. A tier is
+then deployed in the time of its critical path rather than the sum of all stacks.
+'''
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+def get_dependencies(templates):
+    """
+    Returns a dict of template name to the set of template names it depends on.
+    'templates' is a list of DriftTemplate instances. Imports that no template in the
+    list exports are assumed to be satisfied by something else and are ignored.
+    """
+    producers = {}
+    for template in templates:
+        for export in template.exports:
+            producers[export] = template.template_name
+
+    deps = {}
+    for template in templates:
+        deps[template.template_name] = set(
+            producers[name] for name in template.imports
+            if name in producers and producers[name] != template.template_name
+        )
+    return deps
+
+
+def get_waves(deps):
+    """
+    Returns the templates in 'deps' sorted topologically into waves, a list of lists of
+    template names where each template only depends on templates in earlier waves.
+    """
+    remaining = {name: set(d) for name, d in deps.items()}
+    waves = []
+    while remaining:
+        wave = sorted(name for name, d in remaining.items() if not d)
+        if not wave:
+            raise RuntimeError("Circular dependency between templates: {}".format(
+                ', '.join(sorted(remaining))))
+        waves.append(wave)
+        for name in wave:
+            del remaining[name]
+        for d in remaining.values():
+            d.difference_update(wave)
+    return waves
+
+
+class DeployResult(object):
+    """The outcome of deploying one template."""
+    def __init__(self, name, status, error=None):
+        self.name = name
+        self.status = status
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None and self.status != 'SKIPPED'
+
+
+def deploy_all(deps, deploy_fn, max_workers=4, on_result=None):
+    """
+    Call 'deploy_fn(name)' for each template in 'deps', starting each one as soon as all
+    its dependencies have been deployed, running up to 'max_workers' concurrently.
+    'deploy_fn' returns a status string and raises an exception on failure. Templates
+    depending on a failed template are skipped. 'on_result' is called with each
+    DeployResult as it becomes available.
+    Returns a dict of template name to DeployResult.
+    """
+    get_waves(deps)  # Fail early on circular dependencies
+    results = {}
+    lock = threading.Lock()
+
+    def add_result(result):
+        with lock:
+            results[result.name] = result
+        if on_result:
+            on_result(result)
+
+    def run(name):
+        try:
+            return DeployResult(name, deploy_fn(name))
+        except Exception as e:
+            return DeployResult(name, 'FAILED', e)
+
+    pending = dict((name, set(d)) for name, d in deps.items())
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Skip everything that depends on a failed or skipped template
+            for name, d in list(pending.items()):
+                failed = [dep for dep in d if dep in results and not results[dep].ok]
+                if failed:
+                    del pending[name]
+                    add_result(DeployResult(name, 'SKIPPED', "Depends on {}".format(', '.join(sorted(failed)))))
+
+            for name, d in sorted(pending.items()):
+                if all(dep in results for dep in d):
+                    del pending[name]
+                    running[executor.submit(run, name)] = name
+
+            if not running:
+                continue
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                add_result(future.result())
+
+    return results
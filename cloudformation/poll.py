@@ -0,0 +1,155 @@
+'''
+Polling helpers for long running AWS operations.
+
+Stack operations range from a few seconds to well over 20 minutes (NAT gateways,
+RDS instances). Polling at a fixed rate is either too slow at the start or too chatty
+at the end, and several operators polling the same account trip the API rate limits.
+'''
+import collections
+import random
+import threading
+import time
+
+
+THROTTLING_ERROR_CODES = set([
+    'Throttling',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'TooManyRequestsException',
+])
+
+
+def is_throttling_error(e):
+    """Returns True if exception 'e' is an AWS throttling error."""
+    code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLING_ERROR_CODES
+
+
+class PollScheduler(object):
+    """
+    Adaptive poll interval with exponential backoff and jitter.
+
+    Call 'activity()' when a poll returned something new, 'idle()' when it didn't
+    and 'throttled()' when AWS pushed back. 'sleep()' waits for the current interval.
+    """
+    def __init__(self, min_delay=2.0, max_delay=30.0, factor=1.5, jitter=0.25,
+                 throttle_factor=2.0, max_throttle_delay=60.0):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+        self.throttle_factor = throttle_factor
+        self.max_throttle_delay = max_throttle_delay
+        self.delay = min_delay
+        self._throttled = False
+
+    def activity(self):
+        """Something happened, poll quickly again unless we were just throttled."""
+        if self._throttled:
+            self._throttled = False
+        else:
+            self.delay = self.min_delay
+
+    def idle(self):
+        """Nothing happened, back off. A throttled delay decays back to 'max_delay'."""
+        self._throttled = False
+        if self.delay > self.max_delay:
+            self.delay = max(self.delay / self.factor, self.max_delay)
+        else:
+            self.delay = min(self.delay * self.factor, self.max_delay)
+
+    def throttled(self):
+        """AWS is throttling us, back off harder and allow going past 'max_delay'."""
+        self._throttled = True
+        self.delay = min(max(self.delay, self.min_delay) * self.throttle_factor, self.max_throttle_delay)
+
+    def next_delay(self):
+        """Returns the current interval with jitter applied."""
+        spread = self.delay * self.jitter
+        return max(0.0, self.delay + random.uniform(-spread, spread))
+
+    def sleep(self):
+        time.sleep(self.next_delay())
+
+
+def call_polled(fn, *args, **kwargs):
+    """
+    Call boto3 client method 'fn'. Throttled calls are retried by botocore, see
+    'aws.RETRIES', and are not retried here too as the attempts would multiply.
+    If the call is still throttled, 'scheduler' is told before the error is raised,
+    so the caller's poll loop can skip a poll and wait longer for the next one.
+    """
+    scheduler = kwargs.pop('scheduler', None)
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        if scheduler is not None and is_throttling_error(e):
+            scheduler.throttled()
+        raise
+
+
+def poll_once(fn, *args, **kwargs):
+    """
+    Call 'fn' for one step of a poll loop and return its result, or None if AWS
+    throttled it. The scheduler of the throttled call has then backed off, see
+    'call_polled', so the caller just waits for its next poll.
+    """
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        if not is_throttling_error(e):
+            raise
+        return None
+
+
+class SeenEvents(object):
+    """A bounded window of the most recently seen stack event ids.
+
+    Events are returned newest first by CloudFormation so only the ids at the head
+    of the history are needed to know where the previous poll left off.
+    """
+    def __init__(self, size=500):
+        self.size = size
+        self._ids = set()
+        self._order = collections.deque()
+
+    def __contains__(self, event_id):
+        return event_id in self._ids
+
+    def __len__(self):
+        return len(self._order)
+
+    def add(self, event_id):
+        if event_id in self._ids:
+            return
+        self._ids.add(event_id)
+        self._order.append(event_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+
+
+class RateLimiter(object):
+    """
+    Token bucket allowing on average 'rate' calls per second, with bursts of up to
+    'burst' calls. 'acquire()' blocks until a call is allowed. Thread safe.
+    """
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, rate))
+        self.tokens = self.burst
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1.0
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+    def attach(self, client):
+        """Make every API call of boto3 'client' wait for this limiter."""
+        client.meta.events.register('before-call', lambda **kwargs: self.acquire())
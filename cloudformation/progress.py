@@ -0,0 +1,48 @@
+'''
+A live multi-line progress view for the cli.
+
+Each key, i.e. a tier, gets its own line which is redrawn in place when updated. If
+the output is not a terminal, updates are written out as plain lines instead.
+'''
+import shutil
+import sys
+import threading
+
+import click
+
+
+class Progress(object):
+    """One status line per key, redrawn in place on a terminal. Thread safe."""
+    def __init__(self, keys, stream=None):
+        self.stream = stream or sys.stdout
+        self.live = self.stream.isatty()
+        self.keys = list(keys)
+        self.width = max([len(key) for key in self.keys] + [1])
+        self.lines = dict((key, '') for key in self.keys)
+        self.lock = threading.Lock()
+        self.drawn = False
+
+    def _format(self, key):
+        if not self.live:
+            return "{} {}".format(key.ljust(self.width), self.lines[key])
+        # Lines must not wrap or the cursor movement gets out of sync
+        max_len = shutil.get_terminal_size().columns - self.width - 2
+        return "{} {}".format(click.style(key.ljust(self.width), bold=True), self.lines[key][:max_len])
+
+    def _draw(self):
+        if self.drawn:
+            self.stream.write('\x1b[{}A'.format(len(self.keys)))  # Move cursor to the first line
+        for key in self.keys:
+            self.stream.write('\x1b[2K' + self._format(key) + '\n')  # Clear line and write
+        self.stream.flush()
+        self.drawn = True
+
+    def update(self, key, text):
+        """Set the status line of 'key' to 'text'."""
+        with self.lock:
+            self.lines[key] = text.split('\n', 1)[0]
+            if self.live:
+                self._draw()
+            else:
+                self.stream.write(self._format(key) + '\n')
+                self.stream.flush()
@@ -0,0 +1,121 @@
+'''
+Timing profile of a stack operation, built from the stack events.
+
+Each resource of the last stack operation gets a start time, its first IN_PROGRESS
+event, and an end time, its first COMPLETE or FAILED event after that. The critical
+path is found by starting at the resource that finished last and repeatedly stepping
+to the dependency that finished last, i.e. the one it was actually waiting for. The
+dependencies are read from the template: DependsOn, Ref, Fn::GetAtt and Fn::Sub.
+'''
+from poll import call_polled
+from validation import find_references
+
+
+# Stack statuses that mark the start of a stack operation
+START_STATUSES = ['CREATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS', 'DELETE_IN_PROGRESS', 'IMPORT_IN_PROGRESS']
+
+
+class ResourceTiming(object):
+    """Start and end of one resource in a stack operation."""
+    def __init__(self, logical_id, resource_type, start):
+        self.logical_id = logical_id
+        self.resource_type = resource_type
+        self.start = start
+        self.end = None
+        self.status = None
+
+    @property
+    def duration(self):
+        return (self.end - self.start).total_seconds() if self.end else None
+
+
+def get_operation_events(cfn_client, stack_name):
+    """
+    Returns the events of the last operation on 'stack_name' in chronological order.
+    Pages are only read until the event that started the operation is found.
+    """
+    events = []
+    kwargs = {'StackName': stack_name}
+    while 1:
+        response = call_polled(cfn_client.describe_stack_events, **kwargs)
+        for e in response['StackEvents']:
+            events.append(e)
+            if (e['ResourceType'] == 'AWS::CloudFormation::Stack' and e['LogicalResourceId'] == stack_name
+                    and e['ResourceStatus'] in START_STATUSES):
+                return list(reversed(events))
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return list(reversed(events))
+
+
+def get_timings(events, stack_name):
+    """
+    Returns a list of ResourceTiming for the resources in 'events', excluding the stack
+    itself, sorted by start time. Resources that haven't finished have 'end' set to None.
+    """
+    timings = {}
+    for e in events:
+        logical_id = e['LogicalResourceId']
+        if logical_id == stack_name and e['ResourceType'] == 'AWS::CloudFormation::Stack':
+            continue
+        status = e['ResourceStatus']
+        timing = timings.get(logical_id)
+        if timing is None:
+            timing = timings[logical_id] = ResourceTiming(logical_id, e['ResourceType'], e['Timestamp'])
+        if timing.end is None and not status.endswith('_IN_PROGRESS'):
+            timing.end = e['Timestamp']
+            timing.status = status
+    return sorted(timings.values(), key=lambda t: (t.start, t.logical_id))
+
+
+def get_dependencies(template):
+    """
+    Returns a dict of logical id to the set of logical ids it depends on for all the
+    resources in 'template', a template dict.
+    """
+    resources = template.get('Resources', {})
+    deps = {}
+    for logical_id, resource in resources.items():
+        refs, atts = set(), set()
+        depends_on = resource.get('DependsOn', [])
+        refs.update([depends_on] if isinstance(depends_on, str) else depends_on)
+        find_references(resource.get('Properties', {}), refs, atts, set())
+        refs |= atts
+        deps[logical_id] = set(ref for ref in refs if ref in resources and ref != logical_id)
+    return deps
+
+
+def get_critical_path(timings, deps):
+    """
+    Returns the list of ResourceTiming on the critical path in chronological order.
+    'deps' is a dict of logical id to the set of logical ids it depends on.
+    """
+    finished = {t.logical_id: t for t in timings if t.end}
+    if not finished:
+        return []
+    path = [max(finished.values(), key=lambda t: t.end)]
+    while 1:
+        blockers = [finished[dep] for dep in deps.get(path[-1].logical_id, []) if dep in finished]
+        if not blockers:
+            break
+        path.append(max(blockers, key=lambda t: t.end))
+    return list(reversed(path))
+
+
+def format_gantt(timings, width=60):
+    """
+    Returns a list of (timing, bar) where 'bar' is a string of length 'width' showing
+    when the resource was in progress, relative to the whole operation.
+    """
+    if not timings:
+        return []
+    t0 = min(t.start for t in timings)
+    t1 = max(t.end or t.start for t in timings)
+    total = max((t1 - t0).total_seconds(), 1.0)
+    rows = []
+    for t in timings:
+        first = int((t.start - t0).total_seconds() / total * (width - 1))
+        last = int(((t.end or t1) - t0).total_seconds() / total * (width - 1))
+        rows.append((t, ' ' * first + '#' * (last - first + 1) + ' ' * (width - last - 1)))
+    return rows
@@ -0,0 +1,310 @@
+'''
+Stack operations for the cli, using boto3.
+
+Stacks are only ever created or modified through change sets. A change set is created,
+reviewed and then executed, so replacement-causing changes can be spotted before they
+are applied.
+'''
+import time
+
+from botocore.exceptions import ClientError
+
+from poll import PollScheduler, SeenEvents, call_polled, poll_once
+import templatediff
+import templatestore
+
+
+# Stack statuses in which a stack can't be updated, but must be created anew
+NO_STACK_STATUSES = ['REVIEW_IN_PROGRESS']
+
+# Stack statuses in which the stack template is in place, the only ones that can be up to date
+DEPLOYED_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_ROLLBACK_COMPLETE', 'IMPORT_COMPLETE']
+
+# Stack statuses of a failed stack creation. Nothing is deployed and the stack must be
+# deleted before it can be created again.
+FAILED_CREATE_STATUSES = ['CREATE_FAILED', 'ROLLBACK_IN_PROGRESS', 'ROLLBACK_FAILED', 'ROLLBACK_COMPLETE']
+
+# Status reasons of change sets that failed only because nothing changed
+EMPTY_CHANGE_SET_REASONS = [
+    "The submitted information didn't contain changes",
+    "No updates are to be performed",
+]
+
+
+def get_stack(cfn_client, stack_name, scheduler=None):
+    """Returns the description of 'stack_name' or None if it doesn't exist."""
+    try:
+        stacks = call_polled(cfn_client.describe_stacks, StackName=stack_name, scheduler=scheduler)['Stacks']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ValidationError':  # Stack does not exist
+            return None
+        raise
+    return stacks[0] if stacks else None
+
+
+def fold_tags(tags):
+    """Fold boto3 resource tags array into a dictionary."""
+    return {tag['Key']: tag['Value'] for tag in tags}
+
+
+def get_deployed(cfn_client, stack_name):
+    """
+    Returns the deployed template body, parameters dict, tags dict and stack status of
+    'stack_name' or None if the stack doesn't exist. Unless the status is one of
+    DEPLOYED_STATUSES, the template is only the one that was attempted.
+    """
+    stack = get_stack(cfn_client, stack_name)
+    if stack is None or stack['StackStatus'] in NO_STACK_STATUSES:
+        return None
+    response = call_polled(cfn_client.get_template, StackName=stack_name, TemplateStage='Original')
+    params = {p['ParameterKey']: p.get('ParameterValue') for p in stack.get('Parameters', [])}
+    tags = fold_tags(stack.get('Tags', []))
+    return response['TemplateBody'], params, tags, stack['StackStatus']
+
+
+def is_up_to_date(deployed, template_body, params, tags):
+    """
+    Returns True if 'deployed', as returned from 'get_deployed', matches 'template_body',
+    'params' and 'tags', and the stack is in one of DEPLOYED_STATUSES.
+    """
+    if deployed is None:
+        return False
+    deployed_body, deployed_params, deployed_tags, status = deployed
+    if status not in DEPLOYED_STATUSES:
+        return False
+    if any(deployed_tags.get(k) != v for k, v in tags.items()):
+        return False
+    return templatediff.is_unchanged(deployed_body, deployed_params, template_body, params)
+
+
+def to_parameters(params):
+    """Returns boto3 style parameter list from 'params' dict."""
+    return [{'ParameterKey': k, 'ParameterValue': v} for k, v in sorted(params.items())]
+
+
+def to_tags(tags):
+    """Returns boto3 style tag list from 'tags' dict."""
+    return [{'Key': k, 'Value': v} for k, v in sorted(tags.items())]
+
+
+def create_change_set(cfn_client, stack_name, template_body, params, tags, bucket_name=None):
+    """
+    Create a change set for 'stack_name' using 'template_body', 'params' and 'tags' dicts.
+    The change set creates the stack if it doesn't exist yet. Templates too big to pass
+    inline are uploaded to S3 bucket 'bucket_name' first, see 'templatestore'.
+    Returns the change set id, or None if CloudFormation already knows there are no
+    changes.
+    """
+    stack = get_stack(cfn_client, stack_name)
+    if stack is None or stack['StackStatus'] in NO_STACK_STATUSES:
+        change_set_type = 'CREATE'
+    else:
+        change_set_type = 'UPDATE'
+
+    source = templatestore.get_template_source(
+        template_body, stack_name, cfn_client.meta.region_name, bucket_name)
+    try:
+        response = call_polled(
+            cfn_client.create_change_set,
+            StackName=stack_name,
+            ChangeSetName='drift-{}'.format(time.strftime('%Y%m%d%H%M%S', time.gmtime())),
+            ChangeSetType=change_set_type,
+            Parameters=to_parameters(params),
+            Tags=to_tags(tags),
+            Capabilities=['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM'],
+            **source
+        )
+    except ClientError as e:
+        message = e.response['Error'].get('Message', '')
+        if any(r in message for r in EMPTY_CHANGE_SET_REASONS):
+            return None
+        raise
+    return response['Id']
+
+
+def describe_change_set(cfn_client, change_set_id):
+    """Returns the description of change set 'change_set_id' with all pages of changes."""
+    description = call_polled(cfn_client.describe_change_set, ChangeSetName=change_set_id)
+    changes = description['Changes']
+    while description.get('NextToken'):
+        description = call_polled(
+            cfn_client.describe_change_set, ChangeSetName=change_set_id,
+            NextToken=description['NextToken'],
+        )
+        changes.extend(description['Changes'])
+    description['Changes'] = changes
+    return description
+
+
+def wait_for_change_set(cfn_client, change_set_id, scheduler=None):
+    """
+    Wait until change set 'change_set_id' has been created or has failed and return its
+    description. Creating a change set usually takes a few seconds so the polling
+    starts fast.
+    """
+    scheduler = scheduler or PollScheduler(min_delay=1.0, max_delay=5.0, factor=1.3)
+    while 1:
+        description = poll_once(
+            call_polled, cfn_client.describe_change_set, ChangeSetName=change_set_id, scheduler=scheduler)
+        if description is None:
+            scheduler.sleep()
+            continue
+        if description['Status'] in ['CREATE_COMPLETE', 'FAILED', 'DELETE_COMPLETE']:
+            break
+        scheduler.idle()
+        scheduler.sleep()
+    return describe_change_set(cfn_client, change_set_id)
+
+
+def is_empty_change_set(description):
+    """Returns True if change set 'description' failed only because there are no changes."""
+    if description['Status'] != 'FAILED':
+        return False
+    reason = description.get('StatusReason', '')
+    return any(r in reason for r in EMPTY_CHANGE_SET_REASONS)
+
+
+def get_change_rows(description):
+    """
+    Returns the changes in change set 'description' as a list of rows, like the
+    "change set details" in the AWS console: action, logical id, physical id, resource
+    type and replacement.
+    """
+    rows = []
+    for change in description['Changes']:
+        rc = change.get('ResourceChange', {})
+        rows.append([
+            rc.get('Action', ''),
+            rc.get('LogicalResourceId', ''),
+            rc.get('PhysicalResourceId', ''),
+            rc.get('ResourceType', ''),
+            rc.get('Replacement', ''),
+        ])
+    return rows
+
+
+def execute_change_set(cfn_client, change_set_id):
+    call_polled(cfn_client.execute_change_set, ChangeSetName=change_set_id)
+
+
+def delete_change_set(cfn_client, change_set_id):
+    call_polled(cfn_client.delete_change_set, ChangeSetName=change_set_id)
+
+
+def get_new_events(cfn_client, stack_name, seen, scheduler=None):
+    """
+    Get the events for 'stack_name' not in 'seen' and return them in chronological order.
+    Pages are only read until an already seen event is found.
+    """
+    new_events = []
+    kwargs = {'StackName': stack_name}
+    while 1:
+        response = call_polled(cfn_client.describe_stack_events, scheduler=scheduler, **kwargs)
+        for e in response['StackEvents']:
+            if e['EventId'] in seen:
+                return list(reversed(new_events))
+            new_events.append(e)
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
+    return list(reversed(new_events))
+
+
+def mark_events(cfn_client, stack_name):
+    """
+    Returns SeenEvents with the latest event of 'stack_name' marked as seen, so
+    'wait_for_stack' only reports events that happen after this call.
+    """
+    seen = SeenEvents()
+    if get_stack(cfn_client, stack_name) is not None:
+        response = call_polled(cfn_client.describe_stack_events, StackName=stack_name)
+        for e in response['StackEvents'][:1]:
+            seen.add(e['EventId'])
+    return seen
+
+
+def poll_stack(cfn_client, stack_name, seen, scheduler):
+    """
+    Poll 'stack_name' once and return its status and the events not in 'seen', in
+    chronological order. The new events are added to 'seen' and 'scheduler' is told
+    whether anything happened. The status is None if the poll was throttled and
+    'DELETE_COMPLETE' if the stack is gone. This is one step of 'wait_for_stack' and
+    of the coroutines in watch.py.
+    """
+    def poll():
+        stack = get_stack(cfn_client, stack_name, scheduler)
+        if stack is None:
+            return 'DELETE_COMPLETE', []
+        return stack['StackStatus'], get_new_events(cfn_client, stack_name, seen, scheduler)
+
+    result = poll_once(poll)
+    if result is None:
+        return None, []
+
+    status, events = result
+    for e in events:
+        seen.add(e['EventId'])
+    if events:
+        scheduler.activity()
+    else:
+        scheduler.idle()
+    return status, events
+
+
+def wait_for_stack(cfn_client, stack_name, on_event=None, seen=None, scheduler=None):
+    """
+    Wait for the current operation on 'stack_name' to finish and return the final stack
+    status. Events not in 'seen' are passed to 'on_event' as they arrive. If 'seen' is
+    not set, events that happened before this call are skipped, see 'mark_events'.
+    """
+    scheduler = scheduler or PollScheduler()
+    if seen is None:
+        seen = mark_events(cfn_client, stack_name)
+
+    while 1:
+        status, events = poll_stack(cfn_client, stack_name, seen, scheduler)
+        if on_event:
+            for e in events:
+                on_event(e)
+        if status and not status.endswith('_IN_PROGRESS'):
+            return status
+        scheduler.sleep()
+
+
+def deploy_stack(cfn_client, stack_name, template_body, params, tags, on_event=None, force=False,
+                 bucket_name=None):
+    """
+    Create or update 'stack_name' through a change set without asking, and wait for it
+    to finish. Stacks that are up to date are left alone unless 'force' is set.
+    'bucket_name' is the S3 bucket for templates too big to pass inline.
+    Returns 'UP_TO_DATE' or the final stack status. Raises RuntimeError if the change set
+    or the stack operation fails.
+    """
+    deployed = get_deployed(cfn_client, stack_name)
+    if deployed is not None and deployed[3] in FAILED_CREATE_STATUSES:
+        raise RuntimeError("Stack {} is {} and must be deleted before it can be deployed".format(
+            stack_name, deployed[3]))
+    if not force and is_up_to_date(deployed, template_body, params, tags):
+        return 'UP_TO_DATE'
+
+    change_set_id = create_change_set(cfn_client, stack_name, template_body, params, tags, bucket_name)
+    if change_set_id is None:
+        return 'UP_TO_DATE'
+    description = wait_for_change_set(cfn_client, change_set_id)
+    if is_empty_change_set(description):
+        delete_change_set(cfn_client, change_set_id)
+        return 'UP_TO_DATE'
+    if description['Status'] != 'CREATE_COMPLETE':
+        raise RuntimeError("Change set for {} failed: {}".format(stack_name, description.get('StatusReason')))
+
+    seen = mark_events(cfn_client, stack_name)
+    execute_change_set(cfn_client, change_set_id)
+    status = wait_for_stack(cfn_client, stack_name, on_event, seen)
+    if not is_success_status(status):
+        raise RuntimeError("Stack {} is {}".format(stack_name, status))
+    return status
+
+
+def is_success_status(status):
+    """Returns True if stack 'status' is the successful end of a create or update."""
+    return status in ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
@@ -0,0 +1,85 @@
+'''
+Compare a local template and parameters with what is deployed.
+
+Both sides are normalized before comparison so differences in key order and
+whitespace don't count as changes. This makes it possible to skip stack updates that
+would only end with CloudFormation saying "No updates are to be performed".
+'''
+import difflib
+import json
+
+
+# Parameter values CloudFormation masks for NoEcho parameters
+MASKED_VALUE = '****'
+
+
+def load_template(template):
+    """
+    Returns 'template' as a dict. 'template' can be a json string, a dict as returned by
+    boto3 'get_template' or a troposphere Template. Returns None if it's not json, i.e. yaml.
+    """
+    if hasattr(template, 'to_dict'):
+        # Round trip troposphere output through json to get plain types
+        return json.loads(template.to_json())
+    if isinstance(template, dict):
+        return template
+    try:
+        return json.loads(template)
+    except ValueError:
+        return None
+
+
+def normalize_template(template):
+    """Returns a canonical string representation of 'template', see 'load_template'."""
+    ob = load_template(template)
+    if ob is None:
+        return template.strip()
+    return json.dumps(ob, indent=1, sort_keys=True, separators=(',', ': '))
+
+
+def diff_templates(deployed, local):
+    """Returns a unified diff between 'deployed' and 'local' templates as a list of lines."""
+    return list(difflib.unified_diff(
+        normalize_template(deployed).splitlines(),
+        normalize_template(local).splitlines(),
+        'deployed', 'local', lineterm='',
+    ))
+
+
+def diff_parameters(deployed, local):
+    """
+    Returns a dict of parameter name to (deployed value, local value) for parameters in
+    'deployed' and 'local' dicts that differ. Masked NoEcho values count as changed as
+    there's no way to tell.
+    """
+    diff = {}
+    for name in set(deployed) | set(local):
+        old, new = deployed.get(name), local.get(name)
+        if old == MASKED_VALUE or old != new:
+            diff[name] = (old, new)
+    return diff
+
+
+def with_defaults(template, params):
+    """
+    Returns a copy of 'params' with the defaults of all parameters of 'template' that it
+    doesn't set, as CloudFormation returns the values of all parameters of a stack.
+    """
+    ob = load_template(template) or {}
+    filled = {}
+    for name, parameter in ob.get('Parameters', {}).items():
+        if 'Default' in parameter:
+            default = parameter['Default']
+            filled[name] = ','.join(str(v) for v in default) if isinstance(default, list) else str(default)
+    filled.update(params)
+    return filled
+
+
+def is_unchanged(deployed_template, deployed_params, local_template, local_params):
+    """
+    Returns True if the local template and parameters match what is deployed. Parameters
+    left out of 'local_params' get their default value from 'local_template'.
+    """
+    if diff_parameters(deployed_params, with_defaults(local_template, local_params)):
+        return False
+    return normalize_template(deployed_template) == normalize_template(local_template)
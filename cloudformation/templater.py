@@ -1,7 +1,10 @@
 '''
 AWS CloudFormation Template generator
 '''
-
+import json
+import os
+import sys
+import tempfile
 
 from troposphere import Join, Output, Parameter, Ref, Tags, Template, GetAZs, Select, Split, GetAtt, Export, Sub, ImportValue
 from troposphere import ec2, rds, elasticache, s3, elasticloadbalancing
@@ -35,6 +38,8 @@ class DriftTemplate(object):
         'description' is added to the template description.
         """
         self.template_name = template_name
+        self.exports = []  # Names of exported values, without the STACKGROUP- prefix
+        self.imports = []  # Names of imported values, without the STACKGROUP- prefix
         self.t = Template()
         self.t.add_version("2010-09-09")
         self.t.add_description(description)
@@ -70,6 +75,7 @@ class DriftTemplate(object):
         )
 
         self.t.add_output(output)
+        self.exports.append("{}-{}".format(self.template_name, name))
 
     def import_value(self, name, index=None):
         """
@@ -77,13 +83,26 @@ class DriftTemplate(object):
         If the value is an array, select the object using 'index', a number from 0 to n-1.
         """
         export_name = _(Ref(self.stack_group), "-{}".format(name))
+        if name not in self.imports:
+            self.imports.append(name)
         if index is None:
             value = ImportValue(export_name)
         else:
-            value = Select(str(index), Split(',', ImportValue(export_name))),
+            value = Select(str(index), Split(',', ImportValue(export_name)))
 
         return value
 
+    def get_index(self):
+        """
+        Returns a dict with the names of the values this template exports and imports,
+        without the STACKGROUP- prefix. See 'validation.check_exports'.
+        """
+        return {
+            'template': self.template_name,
+            'exports': list(self.exports),
+            'imports': list(self.imports),
+        }
+
     def get_tier_name(self):
         """Returns the tier name by looking up the exported value from STACKGROUP-tier-name."""
         return self.import_value('tier-name')
@@ -290,10 +309,126 @@ class VPC(DriftTemplate):
 
 export = [Tier, VPC]
 
-for c in export:
-    template = c()
-    with open('templates/drift-cfn-{}.json'.format(template.template_name), 'w') as f:
-        f.write(template.t.to_json())
+# Rendered templates are written here by default
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+
+def get_export_class(name):
+    """Returns the class in 'export' for template 'name', which is the class name in lower case."""
+    for c in export:
+        if c.__name__.lower() == name:
+            return c
+    raise RuntimeError("Template '{}' not found. Available templates: {}".format(
+        name, ', '.join(c.__name__.lower() for c in export)))
+
+
+def write_if_changed(filename, body):
+    """
+    Write 'body' to 'filename' unless the file already has the exact same content.
+    Returns True if the file was written. Unchanged files keep their mtime.
+    The file is replaced atomically so readers never see a partially written template.
+    """
+    if os.path.exists(filename):
+        with open(filename) as f:
+            if f.read() == body:
+                return False
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(body)
+    os.chmod(tmp_name, 0o644)
+    os.replace(tmp_name, filename)
+    return True
+
+
+def to_compact_json(template):
+    """
+    Returns troposphere 'template' as minified json. This is what gets deployed, as the
+    size of inline template bodies is limited, see 'templatestore'.
+    """
+    return json.dumps(template.to_dict(), sort_keys=True, separators=(',', ':'))
+
+
+def get_pretty_filename(filename):
+    """Returns the name of the indented copy of template 'filename', for review."""
+    return os.path.splitext(filename)[0] + '.pretty.json'
+
+
+def write_template(filename, template):
+    """
+    Write troposphere 'template' minified to 'filename' and indented next to it.
+    Returns True if either file was written.
+    """
+    changed = write_if_changed(filename, to_compact_json(template))
+    return write_if_changed(get_pretty_filename(filename), template.to_json()) or changed
+
+
+def get_index_filename(filename):
+    """Returns the name of the export/import index file for template 'filename'."""
+    return os.path.splitext(filename)[0] + '.index.json'
+
+
+def write_index(template, filename):
+    """Write the export/import index of 'template' next to template 'filename'."""
+    body = json.dumps(template.get_index(), indent=4, sort_keys=True)
+    return write_if_changed(get_index_filename(filename), body)
+
+
+def load_indexes(out_dir=None):
+    """Returns the export/import indexes of all templates in 'export' rendered into 'out_dir'."""
+    indexes = []
+    for c in export:
+        filename = os.path.join(out_dir or TEMPLATES_DIR, 'drift-cfn-{}.json'.format(c.__name__.lower()))
+        with open(get_index_filename(filename)) as f:
+            indexes.append(json.load(f))
+    return indexes
+
+
+def build_templates(names=None, out_dir=None, force=False):
+    """
+    Render the templates in 'names', or all templates in 'export', into 'out_dir'
+    which defaults to TEMPLATES_DIR. The export/import index of each template is
+    written next to it, as is an indented copy of the template, see 'write_template'.
+    Templates are not rendered at all if the build cache says the file on disk is
+    up to date, unless 'force' is set. Raises RuntimeError if a template doesn't pass
+    'validation.validate_drift_template', before the template is written.
+    Returns a list of (template name, file name, status) tuples where status is one of
+    'written', 'unchanged' or 'cached'.
+    """
+    from buildcache import BuildCache, source_key
+    from validation import validate_drift_template
+
+    out_dir = out_dir or TEMPLATES_DIR
+    classes = [get_export_class(name) for name in names] if names else export
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+
+    cache = BuildCache(out_dir)
+    results = []
+    for c in classes:
+        name = c.__name__.lower()
+        filename = os.path.join(out_dir, 'drift-cfn-{}.json'.format(name))
+        key = source_key(name, [sys.modules[c.__module__]])
+        complete = os.path.exists(get_index_filename(filename)) and os.path.exists(get_pretty_filename(filename))
+        if not force and complete and cache.is_fresh(name, key, filename):
+            results.append((name, filename, 'cached'))
+            continue
+
+        template = c()
+        problems = validate_drift_template(template)
+        if problems:
+            raise RuntimeError('\n'.join(problems))
+        changed = write_template(filename, template.t)
+        changed = write_index(template, filename) or changed
+        cache.update(name, key, filename)
+        results.append((name, filename, 'written' if changed else 'unchanged'))
+
+    cache.save()
+    return results
+
+
+if __name__ == '__main__':
+    for name, filename, status in build_templates():
+        print("{:<10} {}".format(status.title(), filename))
 
 '''
 
@@ -0,0 +1,125 @@
+'''
+Content addressed storage of templates in S3.
+
+Templates are stored under a key made from the template name and a hash of its body,
+so an unchanged template maps to the same key and is never uploaded twice. A HEAD
+request is all it takes to find out if the upload can be skipped. Old versions of each
+template are removed with 'prune_templates'. CloudFormation keeps its own copy of the
+template of a stack, so the S3 objects are not needed once a stack has been deployed.
+'''
+import hashlib
+import re
+
+from botocore.exceptions import ClientError
+
+
+# Max size in bytes of a template body passed inline, bigger ones must go through S3
+MAX_TEMPLATE_BODY_SIZE = 51200
+
+# Template keys, "<name>-<content hash>.json". The timestamped keys of earlier versions,
+# "<name>-<YYYY-MM-DDTHH:MM:SSZ>.json", are recognized too so they get pruned.
+KEY_PATTERN = re.compile(r'^(?P<name>.+)-(?:[0-9a-f]{16}|\d{4}-\d\d-\d\dT\d\d:\d\d:\d\dZ)\.json$')
+
+
+def get_template_key(name, template_body):
+    """Returns the S3 key for 'template_body' of template 'name'."""
+    if name.endswith('.json'):
+        name = name[:-5]
+    digest = hashlib.sha256(template_body.encode('utf-8')).hexdigest()
+    return '{}-{}.json'.format(name, digest[:16])
+
+
+def fits_inline(template_body):
+    """Returns True if 'template_body' is small enough to be passed to CloudFormation inline."""
+    return len(template_body.encode('utf-8')) <= MAX_TEMPLATE_BODY_SIZE
+
+
+def get_default_bucket(sts_client, region):
+    """Returns the name of the default template bucket of the account in 'region'."""
+    account_id = sts_client.get_caller_identity()['Account']
+    return 'drift-cfn-templates-{}-{}'.format(account_id, region)
+
+
+def get_template_url(s3_client, bucket_name, key_name):
+    """
+    Returns the url of 'key_name' in 'bucket_name' on the regional endpoint of
+    's3_client', so CloudFormation doesn't get redirected outside us-east-1.
+    """
+    scheme, host = s3_client.meta.endpoint_url.split('://', 1)
+    if '.' in bucket_name:
+        # Virtual hosted urls don't work over https for bucket names with dots
+        return '{}://{}/{}/{}'.format(scheme, host, bucket_name, key_name)
+    return '{}://{}.{}/{}'.format(scheme, bucket_name, host, key_name)
+
+
+def _create_bucket(s3_client, region, bucket_name):
+    if region == 'us-east-1':
+        s3_client.create_bucket(Bucket=bucket_name)
+    else:
+        s3_client.create_bucket(
+            Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': region})
+
+
+def upload_template(s3_client, region, bucket_name, key_name, template_body):
+    """
+    Upload 'template_body' to 'key_name' in 'bucket_name' unless it's already there.
+    The bucket is created if it doesn't exist. Returns (url, uploaded).
+    """
+    try:
+        s3_client.head_object(Bucket=bucket_name, Key=key_name)
+        return get_template_url(s3_client, bucket_name, key_name), False
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ['404', 'NoSuchKey', 'NoSuchBucket']:
+            raise
+
+    body = template_body.encode('utf-8')
+    try:
+        s3_client.put_object(Bucket=bucket_name, Key=key_name, Body=body)
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchBucket':
+            raise
+        _create_bucket(s3_client, region, bucket_name)
+        s3_client.put_object(Bucket=bucket_name, Key=key_name, Body=body)
+    return get_template_url(s3_client, bucket_name, key_name), True
+
+
+def prune_templates(s3_client, bucket_name, keep=5, prefix=''):
+    """
+    Delete all but the 'keep' most recent versions of each template in 'bucket_name'.
+    Only keys matching 'KEY_PATTERN' are considered. Returns the deleted keys.
+    """
+    versions = {}
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, Prefix=prefix):
+        for ob in page.get('Contents', []):
+            match = KEY_PATTERN.match(ob['Key'])
+            if match:
+                versions.setdefault(match.group('name'), []).append(ob)
+
+    deleted = []
+    for obs in versions.values():
+        obs.sort(key=lambda ob: ob['LastModified'], reverse=True)
+        deleted.extend(ob['Key'] for ob in obs[keep:])
+
+    # delete_objects takes up to 1000 keys per call
+    for i in range(0, len(deleted), 1000):
+        s3_client.delete_objects(
+            Bucket=bucket_name,
+            Delete={'Objects': [{'Key': key} for key in deleted[i:i + 1000]], 'Quiet': True},
+        )
+    return sorted(deleted)
+
+
+def get_template_source(template_body, name, region, bucket_name=None):
+    """
+    Returns the keyword arguments that pass 'template_body' of template or stack 'name'
+    to CloudFormation. That's TemplateBody if it fits inline, or else TemplateURL after
+    uploading it to 'bucket_name', or the default bucket if that is not set.
+    """
+    if fits_inline(template_body):
+        return {'TemplateBody': template_body}
+    from aws import get_client
+    if not bucket_name:
+        bucket_name = get_default_bucket(get_client('sts', region), region)
+    key_name = get_template_key(name, template_body)
+    url, uploaded = upload_template(get_client('s3', region), region, bucket_name, key_name, template_body)
+    return {'TemplateURL': url}
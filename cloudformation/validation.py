@@ -0,0 +1,200 @@
+'''
+Offline checks for Drift templates, no AWS calls involved.
+
+These catch the mistakes CloudFormation would otherwise reject minutes into a deploy,
+see 'validate_template', and run on every template before it's built or deployed.
+'''
+import re
+
+
+def check_exports(indexes):
+    """
+    Check the export/import indexes of a set of templates, as returned by
+    'DriftTemplate.get_index'. Returns a list of problems, which is empty if:
+
+    - every imported value is exported by some template,
+    - no value is exported by more than one template.
+    """
+    producers = {}
+    problems = []
+    for index in indexes:
+        for name in index['exports']:
+            if name in producers:
+                problems.append("Export STACKGROUP-{} of template '{}' collides with template '{}'.".format(
+                    name, index['template'], producers[name]))
+            else:
+                producers[name] = index['template']
+
+    for index in indexes:
+        for name in index['imports']:
+            if name not in producers:
+                problems.append("Template '{}' imports STACKGROUP-{} which no template exports.".format(
+                    index['template'], name))
+
+    return problems
+
+
+# Characters allowed in export names
+EXPORT_NAME = re.compile(r'^[A-Za-z0-9:-]+$')
+
+# Variables in Fn::Sub strings, ${Name} or ${Name.Attribute} but not ${!Literal}
+SUB_VARIABLE = re.compile(r'\$\{([^!.}][^.}]*)[.}]')
+
+
+def find_references(ob, refs, atts, conditions):
+    """
+    Collect the targets of Ref and Fn::Sub in 'refs', Fn::GetAtt in 'atts' and
+    Fn::If in 'conditions' found anywhere in 'ob'. Also used by stackprofile.py.
+    """
+    if isinstance(ob, dict):
+        for key, value in ob.items():
+            if key == 'Ref' and isinstance(value, str):
+                refs.add(value)
+            elif key == 'Fn::GetAtt':
+                atts.add(value[0] if isinstance(value, list) else value.split('.')[0])
+            elif key == 'Fn::If' and isinstance(value, list) and value:
+                conditions.add(value[0])
+            elif key == 'Fn::Sub':
+                text, local = (value[0], value[1]) if isinstance(value, list) else (value, {})
+                if isinstance(text, str):
+                    refs.update(name for name in SUB_VARIABLE.findall(text) if name not in local)
+                if isinstance(value, list):
+                    find_references(value[1:], refs, atts, conditions)
+                continue
+            find_references(value, refs, atts, conditions)
+    elif isinstance(ob, list):
+        for value in ob:
+            find_references(value, refs, atts, conditions)
+
+
+def _check_parameter_value(name, parameter, value):
+    """Returns a list of problems with 'value' for parameter 'name'."""
+    problems = []
+    value = str(value)
+    pattern = parameter.get('AllowedPattern')
+    if pattern is not None:
+        try:
+            if not re.match('(?:{})$'.format(pattern), value):
+                problems.append("Value '{}' of parameter {} doesn't match AllowedPattern {}.".format(
+                    value, name, pattern))
+        except re.error:
+            pass  # Reported by 'validate_template'
+    allowed = parameter.get('AllowedValues')
+    if allowed is not None and value not in [str(v) for v in allowed]:
+        problems.append("Value '{}' of parameter {} is not one of AllowedValues {}.".format(value, name, allowed))
+    if 'MinLength' in parameter and len(value) < int(parameter['MinLength']):
+        problems.append("Value '{}' of parameter {} is shorter than MinLength {}.".format(
+            value, name, parameter['MinLength']))
+    if 'MaxLength' in parameter and len(value) > int(parameter['MaxLength']):
+        problems.append("Value '{}' of parameter {} is longer than MaxLength {}.".format(
+            value, name, parameter['MaxLength']))
+    return problems
+
+
+def validate_template(template, params=None):
+    """
+    Check 'template', a template dict, without calling AWS. Returns a list of problems,
+    which is empty if:
+
+    - the template has at least one resource,
+    - every Ref, Fn::Sub variable, Fn::GetAtt, DependsOn and condition refers to
+      something that exists in the template,
+    - parameter defaults and the values in 'params', if set, meet the parameter
+      constraints and every value in 'params' is a parameter of the template,
+    - every output has a single value and valid export name.
+    """
+    problems = []
+    if not template.get('Resources'):
+        problems.append("Template has no resources.")
+
+    parameters = template.get('Parameters', {})
+    resources = template.get('Resources', {})
+    names = set(parameters) | set(resources)
+
+    sections = [('Resource', name, ob) for name, ob in resources.items()]
+    sections += [('Output', name, ob) for name, ob in template.get('Outputs', {}).items()]
+    for kind, name, ob in sections:
+        refs, atts, conditions = set(), set(), set()
+        find_references(ob, refs, atts, conditions)
+        if ob.get('Condition'):
+            conditions.add(ob['Condition'])
+        for ref in sorted(refs):
+            if ref not in names and not ref.startswith('AWS::'):
+                problems.append("{} {} refers to {} which doesn't exist.".format(kind, name, ref))
+        for att in sorted(atts):
+            if att not in resources:
+                problems.append("{} {} gets an attribute of {} which is not a resource.".format(kind, name, att))
+        for condition in sorted(conditions):
+            if condition not in template.get('Conditions', {}):
+                problems.append("{} {} uses condition {} which doesn't exist.".format(kind, name, condition))
+
+        depends_on = ob.get('DependsOn', [])
+        for dep in [depends_on] if isinstance(depends_on, str) else depends_on:
+            if dep not in resources:
+                problems.append("{} {} depends on {} which is not a resource.".format(kind, name, dep))
+
+        if kind == 'Output':
+            if isinstance(ob.get('Value'), list):
+                problems.append("Output {} has a list as value, not a single value.".format(name))
+            export_name = ob.get('Export', {}).get('Name')
+            if isinstance(export_name, str) and not EXPORT_NAME.match(export_name):
+                problems.append("Output {} has an invalid export name '{}'.".format(name, export_name))
+
+    for name, parameter in sorted(parameters.items()):
+        if 'AllowedPattern' in parameter:
+            try:
+                re.compile(parameter['AllowedPattern'])
+            except re.error as e:
+                problems.append("AllowedPattern of parameter {} is not a valid pattern: {}.".format(name, e))
+        if 'Default' in parameter:
+            problems.extend(_check_parameter_value(name, parameter, parameter['Default']))
+        if params and name in params:
+            problems.extend(_check_parameter_value(name, parameter, params[name]))
+
+    for name in sorted(set(params or []) - set(parameters)):
+        problems.append("Parameter {} is not in the template.".format(name))
+
+    return problems
+
+
+def validate_drift_template(drift_template, params=None):
+    """
+    Check a DriftTemplate, see 'validate_template'. Also checks that all required
+    properties of the resources are set, as troposphere validates them when the
+    template is rendered, that the template has a format version and a description,
+    which CloudFormation doesn't require but every Drift template sets, and that the
+    export and import names are valid.
+    """
+    try:
+        template = drift_template.t.to_dict()
+    except (ValueError, TypeError, AttributeError) as e:
+        return ["{}: {}".format(drift_template.template_name, e)]
+
+    problems = []
+    if 'AWSTemplateFormatVersion' not in template:
+        problems.append("AWSTemplateFormatVersion is missing.")
+    if not template.get('Description'):
+        problems.append("Description is missing.")
+    problems.extend(validate_template(template, params))
+    exports = getattr(drift_template, 'exports', [])
+    for name in exports:
+        if not name.startswith(drift_template.template_name + '-'):
+            problems.append("Export {} is not prefixed with the template name.".format(name))
+    for name in exports + getattr(drift_template, 'imports', []):
+        if not EXPORT_NAME.match(name):
+            problems.append("Export/import name '{}' has invalid characters.".format(name))
+    return ["{}: {}".format(drift_template.template_name, problem) for problem in problems]
+
+
+def validate_templates(templates, params=None, max_workers=8):
+    """
+    Check a list of DriftTemplate instances concurrently, see 'validate_drift_template'.
+    'params' is an optional dict of template name to parameter values. Returns a list
+    of problems for all the templates.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    params = params or {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            lambda template: validate_drift_template(template, params.get(template.template_name)), templates)
+        return sum(results, [])
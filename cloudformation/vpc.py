@@ -280,5 +280,11 @@ t.add_output([
 ])
 
 
-print t.to_json()
-#print t.to_yaml()
+def get_template():
+    """Returns the template, used by generate.py."""
+    return t
+
+
+if __name__ == '__main__':
+    print(get_template().to_json())
+    #print(get_template().to_yaml())
@@ -0,0 +1,70 @@
+'''
+Follow the event streams of many stacks at once.
+
+Each stack is polled by its own coroutine with its own adaptive poll interval. The
+blocking boto3 calls run on a small thread pool and share a single client, and so a
+single connection pool. Events of all the stacks are passed to one callback in the
+order they arrive.
+'''
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from poll import PollScheduler
+import stacks
+
+
+class StackWatch(object):
+    """The state of one watched stack."""
+    def __init__(self, stack_name):
+        self.stack_name = stack_name
+        self.status = None
+        self.events = 0
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def duration(self):
+        return (self.finished or time.time()) - self.started
+
+
+async def _watch_stack(loop, executor, cfn_client, watch, on_event):
+    """Follow 'watch.stack_name' until the current operation on it has finished."""
+    def call(fn, *args):
+        return loop.run_in_executor(executor, fn, *args)
+
+    scheduler = PollScheduler()
+    seen = await call(stacks.mark_events, cfn_client, watch.stack_name)
+    while 1:
+        status, events = await call(stacks.poll_stack, cfn_client, watch.stack_name, seen, scheduler)
+        watch.status = status or watch.status
+        for e in events:
+            watch.events += 1
+            on_event(watch.stack_name, e)
+
+        if status and not status.endswith('_IN_PROGRESS'):
+            watch.finished = time.time()
+            return watch
+        await asyncio.sleep(scheduler.next_delay())
+
+
+def watch_stacks(cfn_client, stack_names, on_event, max_workers=8):
+    """
+    Follow the events of all stacks in 'stack_names' until none of them has an operation
+    in progress. New events are passed to 'on_event(stack_name, event)'.
+    'cfn_client' should allow at least 'max_workers' pooled connections.
+    Returns a list of StackWatch, one for each stack.
+    """
+    watches = [StackWatch(stack_name) for stack_name in stack_names]
+
+    async def watch_all(executor):
+        loop = asyncio.get_event_loop()
+        await asyncio.gather(*[_watch_stack(loop, executor, cfn_client, watch, on_event) for watch in watches])
+
+    loop = asyncio.new_event_loop()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            loop.run_until_complete(watch_all(executor))
+    finally:
+        loop.close()
+    return watches